@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+import pytest
+
+
+# Optional or heavy dependencies, only imported when they are used
+LAZY_MODULES = ("numpy", "sqlite3", "lz4", "PIL", "decrunch", "fsb5")
+
+# Budget for the cumulative import time of each module, in microseconds
+IMPORT_BUDGET = 250000
+
+
+def import_module(name):
+	"""
+	Import `name` in a fresh interpreter, returning the modules it loaded
+	and the cumulative time it took to import, in microseconds.
+	"""
+	code = "import sys, %s; print(' '.join(sys.modules))" % (name)
+	proc = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", code],
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+	)
+	elapsed = None
+	for line in proc.stderr.splitlines():
+		# import time: self [us] | cumulative | imported package
+		if line.startswith("import time:") and line.split("|")[-1].strip() == name:
+			elapsed = int(line.split("|")[1])
+	return set(proc.stdout.split()), elapsed
+
+
+@pytest.mark.parametrize("name", ["unitypack", "unitypack.environment"])
+def test_import_is_lazy(name):
+	modules, elapsed = import_module(name)
+	assert not modules.intersection(LAZY_MODULES)
+	assert elapsed is not None
+	assert elapsed < IMPORT_BUDGET, "importing %s took %ims" % (name, elapsed // 1000)
@@ -1,15 +1,22 @@
-import pkg_resources
-
+def load(file, env=None):
+	from .environment import UnityEnvironment
 
-__version__ = pkg_resources.require("unitypack")[0].version
+	if env is None:
+		env = UnityEnvironment()
+	return env.load(file)
 
 
-def load(file, env=None):
+def scan(file, env=None):
+	"""
+	Read only the header and the directory of the bundle in `file`, and
+	return it without loading its assets. See AssetBundle.scan().
+	"""
+	from .assetbundle import AssetBundle
 	from .environment import UnityEnvironment
 
 	if env is None:
 		env = UnityEnvironment()
-	return env.load(file)
+	return AssetBundle(env).scan(file)
 
 
 def load_from_file(file, env=None):
@@ -18,3 +25,12 @@ def load_from_file(file, env=None):
 	if env is None:
 		env = UnityEnvironment()
 	return env.get_asset_by_filename(file)
+
+
+def __getattr__(name):
+	# Looking up the version is comparatively slow; only do it when asked
+	if name == "__version__":
+		from importlib.metadata import version
+
+		return version("unitypack")
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -2,13 +2,12 @@ import logging
 import lzma
 import os
 from binascii import hexlify
-from io import BytesIO
-from uuid import UUID
+from fnmatch import fnmatchcase
 
 from .exceptions import ArchiveNotFound
-from .object import ObjectInfo
+from .object import ObjectTable
 from .type import TypeMetadata
-from .utils import BinaryReader
+from .utils import MemoryReader, make_reader
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +22,7 @@ class Asset:
 		ret.bundle = bundle
 		ret.environment = bundle.environment
 		offset = buf.tell()
-		ret._buf = BinaryReader(buf, endian=">")
+		ret._buf = make_reader(buf, endian=">")
 
 		if bundle.is_unityfs:
 			ret._buf_ofs = buf.tell()
@@ -40,8 +39,8 @@ class Asset:
 		ofs = buf.tell()
 		if bundle.compressed:
 			dec = lzma.LZMADecompressor()
-			data = dec.decompress(buf.read())
-			ret._buf = BinaryReader(BytesIO(data[header_size:]), endian=">")
+			data = dec.decompress(buf.read_view())
+			ret._buf = MemoryReader(memoryview(data)[header_size:], endian=">")
 			ret._buf_ofs = 0
 			buf.seek(ofs)
 		else:
@@ -52,15 +51,16 @@ class Asset:
 		return ret
 
 	@classmethod
-	def from_file(cls, file, environment=None):
+	def from_file(cls, file, environment=None, use_mmap=False):
 		ret = cls()
 		ret.name = file.name
 		ret._buf_ofs = file.tell()
-		ret._buf = BinaryReader(file)
+		ret._buf = make_reader(file, use_mmap=use_mmap)
 		base_path = os.path.abspath(os.path.dirname(file.name))
 		if environment is None:
 			from .environment import UnityEnvironment
-			ret.environment = UnityEnvironment(base_path=base_path)
+			environment = UnityEnvironment(base_path=base_path, use_mmap=use_mmap)
+		ret.environment = environment
 		return ret
 
 	def get_asset(self, path):
@@ -78,8 +78,9 @@ class Asset:
 			return None
 
 	def __init__(self):
+		self._buf = None
 		self._buf_ofs = None
-		self._objects = {}
+		self._objects = ObjectTable(self)
 		self.adds = []
 		self.asset_refs = [self]
 		self.types = {}
@@ -89,10 +90,19 @@ class Asset:
 		self.long_object_ids = False
 		self.tree = TypeMetadata(self)
 		self.loaded = False
+		self._names = None
 
 	def __repr__(self):
 		return "<%s %s>" % (self.__class__.__name__, self.name)
 
+	def close(self):
+		"""
+		Close the reader of the asset, unmapping its file if it was
+		memory-mapped.
+		"""
+		if self._buf is not None:
+			self._buf.close()
+
 	@property
 	def objects(self):
 		if not self.loaded:
@@ -122,18 +132,22 @@ class Asset:
 			if self.endianness == 0:
 				buf.endian = "<"
 
+			if not isinstance(buf, MemoryReader):
+				# Read the metadata in one go and parse it from memory,
+				# padded so that align() stays relative to the stream.
+				pad = buf.tell() % 4
+				data = bytes(pad) + buf.read(self.metadata_size)
+				buf = MemoryReader(data, endian=buf.endian, offset=pad)
+
 		self.tree.load(buf)
 
 		if 7 <= self.format <= 13:
 			self.long_object_ids = bool(buf.read_uint())
 
 		num_objects = buf.read_uint()
-		for i in range(num_objects):
-			if self.format >= 14:
-				buf.align()
-			obj = ObjectInfo(self)
-			obj.load(buf)
-			self.register_object(obj)
+		self._objects.load(buf, num_objects)
+		for type_id, class_id in self._objects.types():
+			self.register_type(type_id, class_id)
 
 		if self.format >= 11:
 			num_adds = buf.read_uint()
@@ -160,21 +174,67 @@ class Asset:
 		else:
 			return buf.read_int()
 
-	def register_object(self, obj):
-		if obj.type_id in self.tree.type_trees:
-			self.types[obj.type_id] = self.tree.type_trees[obj.type_id]
-		elif obj.type_id not in self.types:
+	def register_type(self, type_id, class_id):
+		if type_id in self.tree.type_trees:
+			self.types[type_id] = self.tree.type_trees[type_id]
+		elif type_id not in self.types:
 			trees = TypeMetadata.default(self).type_trees
-			if obj.class_id in trees:
-				self.types[obj.type_id] = trees[obj.class_id]
+			if class_id in trees:
+				self.types[type_id] = trees[class_id]
 			else:
-				logger.warning("%r absent from structs.dat", obj.class_id)
-				self.types[obj.type_id] = None
+				logger.warning("%r absent from structs.dat", class_id)
+				self.types[type_id] = None
+
+	def register_object(self, obj):
+		self.register_type(obj.type_id, obj.class_id)
+		self._objects.add(obj)
+		self._names = None
+
+	def read_objects(self, lazy=False, fields=None):
+		"""
+		Read all the objects of the asset, yielding `(path_id, object)`
+		tuples. See ObjectInfo.read() for `lazy` and `fields`.
+		"""
+		for path_id, obj in self.objects.items():
+			yield path_id, obj.read(lazy=lazy, fields=fields)
 
-		if obj.path_id in self._objects:
-			raise ValueError("Duplicate asset object: %r (path_id=%r)" % (obj, obj.path_id))
+	@property
+	def names(self):
+		"""
+		A dict of the names of the objects to the path_ids of the objects
+		with that name, built the first time it is used by decoding only
+		the m_Name of every object.
+		"""
+		if self._names is None:
+			names = {}
+			for path_id, obj in self.objects.items():
+				name = obj.read_name()
+				if name and isinstance(name, str):
+					names.setdefault(name, []).append(path_id)
+			self._names = names
+		return self._names
+
+	def find_by_name(self, pattern, match="exact"):
+		"""
+		Return the ObjectInfos of the objects whose name matches `pattern`.
+		`match` is one of "exact", "substring" (case-insensitive) or "glob"
+		(case-insensitive fnmatch-style patterns).
+		"""
+		names = self.names
+		if match == "exact":
+			keys = [pattern] if pattern in names else []
+		elif match == "substring":
+			pattern = pattern.lower()
+			keys = [name for name in names if pattern in name.lower()]
+		elif match == "glob":
+			pattern = pattern.lower()
+			keys = [name for name in names if fnmatchcase(name.lower(), pattern)]
+		else:
+			raise ValueError("Unknown match type: %r" % (match))
 
-		self._objects[obj.path_id] = obj
+		objects = self._objects
+		path_ids = sorted(path_id for name in keys for path_id in names[name])
+		return [objects[path_id] for path_id in path_ids]
 
 	def pretty(self):
 		ret = []
@@ -195,6 +255,8 @@ class AssetRef:
 		)
 
 	def load(self, buf):
+		from uuid import UUID
+
 		self.asset_path = buf.read_string()
 		self.guid = UUID(hexlify(buf.read(16)).decode("utf-8"))
 		self.type = buf.read_int()
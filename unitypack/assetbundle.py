@@ -1,16 +1,48 @@
 import lzma
 import struct
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
 from io import BytesIO
+from itertools import count
 
 from .asset import Asset
 from .enums import CompressionType
-from .utils import BinaryReader, lz4_decompress
+from .utils import LRUCache, MemoryReader, lz4_decompress, make_reader
 
 
 SIGNATURE_RAW = "UnityRaw"
 SIGNATURE_WEB = "UnityWeb"
 SIGNATURE_FS = "UnityFS"
 
+DEFAULT_BLOCK_CACHE_SIZE = 16 * 1024 * 1024
+LZMA_DIRECTORY_CHUNK = 4096
+
+
+BundleNode = namedtuple("BundleNode", ("name", "offset", "size", "status"))
+BundleNode.__doc__ = """
+An entry in the directory of a bundle: the name of a file in it, and its
+offset and size in the bundle's data.
+"""
+
+
+def _parse_directory(data):
+	# A UnityRaw/UnityWeb directory: a count of entries, each a
+	# null-terminated name followed by an offset and a size.
+	# Returns None if data ends before the directory does.
+	if len(data) < 4:
+		return None
+	(count, ) = struct.unpack_from(">i", data)
+	pos = 4
+	entries = []
+	for i in range(count):
+		end = data.find(b"\0", pos)
+		if end < 0 or end + 9 > len(data):
+			return None
+		ofs, size = struct.unpack_from(">II", data, end + 1)
+		entries.append((data[pos:end].decode("utf-8"), ofs, size))
+		pos = end + 9
+	return entries
+
 
 class AssetBundle:
 	def __init__(self, environment):
@@ -30,8 +62,58 @@ class AssetBundle:
 	def compressed(self):
 		return self.signature == SIGNATURE_WEB
 
-	def load(self, file):
-		buf = BinaryReader(file, endian=">")
+	def load(self, file, use_mmap=None, decompress_workers=None):
+		"""
+		Load the bundle from `file`. If `decompress_workers` is set (it
+		defaults to the environment's), all the blocks of UnityFS bundles are
+		decompressed upfront across that many threads into a contiguous buffer.
+		"""
+		if decompress_workers is None:
+			decompress_workers = self.environment.decompress_workers
+		self.decompress_workers = decompress_workers
+		buf = self.load_header(file, use_mmap)
+
+		if self.is_unityfs:
+			self.load_unityfs(buf)
+		else:
+			self.load_raw(buf)
+
+	def scan(self, file, use_mmap=None):
+		"""
+		Read only the header and the directory of the bundle in `file`:
+		the nodes (as BundleNode tuples) and, for UnityFS bundles, the block
+		layout. No asset is created and no data is decompressed until a
+		node is opened with open().
+		"""
+		self.decompress_workers = self.environment.decompress_workers
+		buf = self.load_header(file, use_mmap)
+
+		if self.is_unityfs:
+			self.scan_unityfs(buf)
+		else:
+			self.scan_raw(buf)
+		return self
+
+	def close(self):
+		"""
+		Close the readers of the bundle and of its assets, unmapping the
+		bundle if it was memory-mapped.
+		"""
+		for asset in self.assets:
+			asset.close()
+		storage = getattr(self, "storage", None)
+		if isinstance(storage, MemoryReader):
+			storage.close()
+			if isinstance(storage.buf, memoryview):
+				# A slice of the bundle's own reader
+				storage.buf.release()
+		if hasattr(self, "_buf"):
+			self._buf.close()
+
+	def load_header(self, file, use_mmap=None):
+		if use_mmap is None:
+			use_mmap = self.environment.use_mmap
+		buf = make_reader(file, endian=">", use_mmap=use_mmap)
 		self.path = file.name
 
 		# Verify that the format starts with b"Unity"
@@ -45,14 +127,57 @@ class AssetBundle:
 		self.unity_version = buf.read_string()
 		self.generator_version = buf.read_string()
 
+		if self.signature not in (SIGNATURE_FS, SIGNATURE_RAW, SIGNATURE_WEB):
+			raise NotImplementedError("Unrecognized file signature %r in %r" % (self.signature, self.path))
+		self._buf = buf
+		return buf
+
+	def open(self, node):
+		"""
+		Return the Asset of `node` (a BundleNode or its name), creating it
+		if it wasn't yet.
+		"""
+		if isinstance(node, str):
+			for n in self.nodes:
+				if n.name == node:
+					node = n
+					break
+			else:
+				raise KeyError("No such node: %r" % (node))
+
+		for asset in self.assets:
+			if asset.name == node.name:
+				return asset
+
 		if self.is_unityfs:
-			self.load_unityfs(buf)
-		elif self.signature in (SIGNATURE_RAW, SIGNATURE_WEB):
-			self.load_raw(buf)
+			storage = self.get_storage()
+			storage.seek(node.offset)
+			asset = Asset.from_bundle(self, storage)
+			asset.name = node.name
+		elif not self.compressed:
+			buf = self._buf
+			buf.seek(self._entry_offsets[node.name])
+			asset = Asset.from_bundle(self, buf)
+		elif node is self.nodes[0]:
+			buf = self._buf
+			buf.seek(self.header_size)
+			asset = Asset.from_bundle(self, buf)
+			asset.name = node.name
 		else:
-			raise NotImplementedError("Unrecognized file signature %r in %r" % (self.signature, self.path))
+			raise NotImplementedError("Only the first asset of %s bundles can be opened" % (self.signature))
+
+		self.assets.append(asset)
+		return asset
 
 	def load_raw(self, buf):
+		self.scan_raw(buf)
+
+		# Preload assets; only the first one of UnityWeb bundles can be read
+		nodes = self.nodes[:1] if self.compressed else self.nodes
+		for node in nodes:
+			self.open(node)
+
+	def scan_raw(self, buf):
 		self.file_size = buf.read_uint()
 		self.header_size = buf.read_int()
 
@@ -73,15 +198,41 @@ class AssetBundle:
 		buf.read_byte()
 		self.name = buf.read_string()
 
-		# Preload assets
+		# The directory follows the header, at the start of the compressed
+		# data in UnityWeb bundles
 		buf.seek(self.header_size)
-		if not self.compressed:
-			num_assets = buf.read_int()
+		self._entry_offsets = {}
+		if self.compressed:
+			entries = self.read_lzma_directory(buf)
 		else:
-			num_assets = 1
-		for i in range(num_assets):
-			asset = Asset.from_bundle(self, buf)
-			self.assets.append(asset)
+			entries = []
+			for i in range(buf.read_int()):
+				entry_offset = buf.tell()
+				name = buf.read_string()
+				entries.append((name, buf.read_uint(), buf.read_uint()))
+				self._entry_offsets[name] = entry_offset
+		self.nodes = tuple(BundleNode(name, ofs, size, 0) for name, ofs, size in entries)
+
+	def read_lzma_directory(self, buf):
+		"""
+		Read the directory at the start of the LZMA data of a UnityWeb
+		bundle, only decompressing as much of it as that takes.
+		"""
+		dec = lzma.LZMADecompressor()
+		data = b""
+		while True:
+			entries = _parse_directory(data)
+			if entries is not None:
+				return entries
+			if dec.eof:
+				raise ValueError("Truncated directory in %r" % (self.path))
+			if dec.needs_input:
+				chunk = buf.read(LZMA_DIRECTORY_CHUNK)
+				if not chunk:
+					raise ValueError("Truncated directory in %r" % (self.path))
+			else:
+				chunk = b""
+			data += dec.decompress(chunk, LZMA_DIRECTORY_CHUNK)
 
 	def read_compressed_data(self, buf, compression):
 		data = buf.read(self.ciblock_size)
@@ -94,20 +245,26 @@ class AssetBundle:
 		raise NotImplementedError("Unimplemented compression method: %r" % (compression))
 
 	def load_unityfs(self, buf):
+		self.scan_unityfs(buf)
+		for node in self.nodes:
+			self.open(node)
+
+	def scan_unityfs(self, buf):
 		self.file_size = buf.read_int64()
 		self.ciblock_size = buf.read_uint()
 		self.uiblock_size = buf.read_uint()
 		flags = buf.read_uint()
-		compression = CompressionType(flags & 0x3F)
+		self.compression = CompressionType(flags & 0x3F)
 		eof_metadata = flags & 0x80
 		if eof_metadata:
 			orig_pos = buf.tell()
 			buf.seek(-self.ciblock_size, 2)
-		data = self.read_compressed_data(buf, compression)
+		data = self.read_compressed_data(buf, self.compression)
 		if eof_metadata:
 			buf.seek(orig_pos)
+		self._data_offset = buf.tell()
 
-		blk = BinaryReader(BytesIO(data), endian=">")
+		blk = MemoryReader(data, endian=">")
 		self.guid = blk.read(16)
 		num_blocks = blk.read_int()
 		blocks = []
@@ -115,6 +272,7 @@ class AssetBundle:
 			busize, bcsize = blk.read_int(), blk.read_int()
 			bflags = blk.read_int16()
 			blocks.append(ArchiveBlockInfo(busize, bcsize, bflags))
+		self.blocks = blocks
 
 		num_nodes = blk.read_int()
 		nodes = []
@@ -123,17 +281,45 @@ class AssetBundle:
 			size = blk.read_int64()
 			status = blk.read_int()
 			name = blk.read_string()
-			nodes.append((ofs, size, status, name))
-
-		storage = ArchiveBlockStorage(blocks, buf)
-		for ofs, size, status, name in nodes:
-			storage.seek(ofs)
-			asset = Asset.from_bundle(self, storage)
-			asset.name = name
-			self.assets.append(asset)
+			nodes.append(BundleNode(name, ofs, size, status))
+		self.nodes = tuple(nodes)
 
 		# Hacky
-		self.name = self.assets[0].name
+		self.name = nodes[0].name
+		self.storage = None
+
+	def get_storage(self):
+		"""
+		Return the storage of the data of a UnityFS bundle, creating it
+		the first time.
+		"""
+		if self.storage is not None:
+			return self.storage
+
+		buf = self._buf
+		blocks = self.blocks
+		buf.seek(self._data_offset)
+		if isinstance(buf, MemoryReader) and not any(b.compressed for b in blocks):
+			# Uncompressed blocks are contiguous: serve them straight from memory
+			start = buf.tell()
+			end = start + sum(b.uncompressed_size for b in blocks)
+			storage = MemoryReader(buf.view[start:end], endian=">")
+		else:
+			storage = ArchiveBlockStorage(blocks, buf, cache=self.environment.block_cache)
+			if self.decompress_workers:
+				data = storage.decompress_all(workers=self.decompress_workers)
+				storage = MemoryReader(data, endian=">")
+		self.storage = storage
+		return storage
+
+	def prefetch(self, start=0, end=None, workers=None):
+		"""
+		Decompress the blocks of a UnityFS bundle covering `start` to `end`
+		of its data (all of it by default) into the block cache, across
+		`workers` threads.
+		"""
+		if isinstance(getattr(self, "storage", None), ArchiveBlockStorage):
+			self.storage.prefetch(start, end, workers=workers or self.decompress_workers or None)
 
 
 class ArchiveBlockInfo:
@@ -159,7 +345,7 @@ class ArchiveBlockInfo:
 
 	def decompress(self, buf):
 		if not self.compressed:
-			return buf
+			return buf.read(self.uncompressed_size)
 		ty = self.compression_type
 		if ty == CompressionType.LZMA:
 			props, dict_size = struct.unpack("<BI", buf.read(5))
@@ -174,21 +360,46 @@ class ArchiveBlockInfo:
 				"lp": lp,
 				"pb": pb,
 			}])
-			res = dec.decompress(buf.read())
-			return BytesIO(res)
+			return dec.decompress(buf.read())
 		if ty in (CompressionType.LZ4, CompressionType.LZ4HC):
-			res = lz4_decompress(buf.read(self.compressed_size), self.uncompressed_size)
-			return BytesIO(res)
+			return lz4_decompress(buf.read(self.compressed_size), self.uncompressed_size)
 		raise NotImplementedError("Unimplemented compression method: %r" % (ty))
 
 
+class BlockCache(LRUCache):
+	"""
+	A byte-bounded LRU cache of decompressed archive blocks.
+	One cache may be shared by all the ArchiveBlockStorages of an environment.
+	"""
+	def __init__(self, max_size=DEFAULT_BLOCK_CACHE_SIZE):
+		super().__init__(max_size)
+
+	def put(self, key, data):
+		super().put(key, data, len(data))
+
+
 class ArchiveBlockStorage:
-	def __init__(self, blocks, stream):
+	_ids = count()
+
+	def __init__(self, blocks, stream, cache=None):
 		self.blocks = blocks
 		self.stream = stream
+		self.cache = cache if cache is not None else BlockCache(0)
+		self.id = next(self._ids)
 		self.cursor = 0
 		self.basepos = stream.tell()
-		self.maxpos = sum([b.uncompressed_size for b in blocks])
+
+		# Uncompressed and compressed start offsets of every block
+		self.block_starts = []
+		self.compressed_starts = []
+		ofs, baseofs = 0, 0
+		for b in blocks:
+			self.block_starts.append(ofs)
+			self.compressed_starts.append(baseofs)
+			ofs += b.uncompressed_size
+			baseofs += b.compressed_size
+		self.maxpos = ofs
+
 		self.sought = False
 		self.current_block = None
 		self.current_block_start = 0
@@ -196,7 +407,7 @@ class ArchiveBlockStorage:
 		self._seek(0)
 
 	def read(self, size=-1):
-		buf = bytearray()
+		parts = []
 		while size != 0 and self.cursor < self.maxpos:
 			if not self.in_current_block(self.cursor):
 				self.seek_to_block(self.cursor)
@@ -206,8 +417,11 @@ class ArchiveBlockStorage:
 					raise EOFError()
 				size -= len(part)
 			self.cursor += len(part)
-			buf += part
-		return bytes(buf)
+			parts.append(part)
+		if len(parts) == 1:
+			# Reads within a single block need no copy
+			return parts[0]
+		return b"".join(parts)
 
 	def seek(self, offset, whence=0):
 		new_cursor = 0
@@ -236,20 +450,88 @@ class ArchiveBlockStorage:
 		return self.current_block_start <= pos and pos < end
 
 	def seek_to_block(self, pos):
-		baseofs = 0
-		ofs = 0
-		for b in self.blocks:
-			if ofs + b.uncompressed_size > pos:
-				self.current_block = b
-				break
-			baseofs += b.compressed_size
-			ofs += b.uncompressed_size
-		else:
+		if pos < 0 or pos >= self.maxpos:
 			self.current_block = None
 			self.current_stream = BytesIO(b"")
 			return
 
-		self.current_block_start = ofs
-		self.stream.seek(self.basepos + baseofs)
-		buf = BytesIO(self.stream.read(self.current_block.compressed_size))
-		self.current_stream = self.current_block.decompress(buf)
+		index = bisect_right(self.block_starts, pos) - 1
+		self.current_block = self.blocks[index]
+		self.current_block_start = self.block_starts[index]
+		self.current_stream = BytesIO(self.get_block(index))
+
+	def block_range(self, start=0, end=None):
+		"""
+		Return the indices of the blocks covering `start` to `end`.
+		"""
+		if end is None or end > self.maxpos:
+			end = self.maxpos
+		if start >= end:
+			return range(0)
+		first = bisect_right(self.block_starts, start) - 1
+		last = bisect_left(self.block_starts, end)
+		return range(max(first, 0), last)
+
+	def prefetch(self, start=0, end=None, workers=None):
+		"""
+		Decompress the compressed blocks covering `start` to `end` into the
+		block cache, across a pool of `workers` threads.
+		"""
+		indices = [
+			i for i in self.block_range(start, end)
+			if self.blocks[i].compressed and (self.id, i) not in self.cache
+		]
+		for index, data in self._decompress(indices, workers):
+			self.cache.put((self.id, index), data)
+
+	def decompress_all(self, workers=None):
+		"""
+		Decompress every block across a pool of `workers` threads and return
+		the data as one contiguous bytearray.
+		"""
+		ret = bytearray(self.maxpos)
+		for index, data in self._decompress(range(len(self.blocks)), workers):
+			start = self.block_starts[index]
+			ret[start:start + len(data)] = data
+		return ret
+
+	def _decompress(self, indices, workers):
+		if not indices:
+			return
+
+		# The blocks are contiguous: read their compressed data in one go
+		first, last = indices[0], indices[-1]
+		start = self.compressed_starts[first]
+		end = self.compressed_starts[last] + self.blocks[last].compressed_size
+		self.stream.seek(self.basepos + start)
+		data = memoryview(self.stream.read(end - start))
+
+		def decompress(index):
+			ofs = self.compressed_starts[index] - start
+			block = self.blocks[index]
+			return index, block.decompress(BytesIO(data[ofs:ofs + block.compressed_size]))
+
+		from concurrent.futures import ThreadPoolExecutor
+
+		# lz4 and lzma release the GIL while decompressing
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			yield from pool.map(decompress, indices)
+
+	def get_block(self, index):
+		"""
+		Return the decompressed data of the block at `index`, going through
+		the block cache.
+		"""
+		block = self.blocks[index]
+		if not block.compressed:
+			self.stream.seek(self.basepos + self.compressed_starts[index])
+			return self.stream.read(block.compressed_size)
+
+		key = (self.id, index)
+		data = self.cache.get(key)
+		if data is None:
+			self.stream.seek(self.basepos + self.compressed_starts[index])
+			buf = BytesIO(self.stream.read(block.compressed_size))
+			data = block.decompress(buf)
+			self.cache.put(key, data)
+		return data
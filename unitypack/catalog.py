@@ -0,0 +1,259 @@
+"""
+A persistent catalog of the contents of bundles and asset files.
+
+The catalog is a SQLite database which records, for every file added to it,
+its assets, their object tables (with the m_Name of each object) and their
+external references. Files are keyed by path, size and modification time, so
+that files which changed are indexed again. Lookups by object name, class or
+path_id are answered from the catalog without opening any file.
+
+Reading the m_Name of every object means decoding part of each of them, so
+names are only recorded when files are added if the catalog is opened with
+`names` set; otherwise they are recorded per asset with add_names().
+"""
+import os
+import sqlite3
+from collections import namedtuple
+from threading import Lock
+
+
+SCHEMA = """
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS files (
+	id INTEGER PRIMARY KEY,
+	path TEXT UNIQUE NOT NULL,
+	size INTEGER NOT NULL,
+	mtime REAL NOT NULL,
+	signature TEXT
+);
+
+CREATE TABLE IF NOT EXISTS assets (
+	id INTEGER PRIMARY KEY,
+	file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+	name TEXT NOT NULL,
+	format INTEGER,
+	node_offset INTEGER,
+	node_size INTEGER,
+	named INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS objects (
+	asset_id INTEGER NOT NULL REFERENCES assets(id) ON DELETE CASCADE,
+	path_id INTEGER NOT NULL,
+	class_id INTEGER NOT NULL,
+	type_id INTEGER NOT NULL,
+	data_offset INTEGER NOT NULL,
+	size INTEGER NOT NULL,
+	name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS refs (
+	asset_id INTEGER NOT NULL REFERENCES assets(id) ON DELETE CASCADE,
+	file_id INTEGER NOT NULL,
+	path TEXT NOT NULL,
+	guid TEXT
+);
+
+CREATE INDEX IF NOT EXISTS assets_file ON assets(file_id);
+CREATE INDEX IF NOT EXISTS assets_name ON assets(name);
+CREATE INDEX IF NOT EXISTS objects_asset ON objects(asset_id);
+CREATE INDEX IF NOT EXISTS objects_name ON objects(name);
+CREATE INDEX IF NOT EXISTS objects_class ON objects(class_id);
+CREATE INDEX IF NOT EXISTS objects_path_id ON objects(path_id);
+CREATE INDEX IF NOT EXISTS refs_asset ON refs(asset_id);
+"""
+
+
+CatalogEntry = namedtuple("CatalogEntry", (
+	"path", "signature", "asset", "path_id", "class_id", "type_id", "data_offset", "size", "name"
+))
+CatalogEntry.__doc__ = """
+An object recorded in a catalog: the file and asset it is in, where its data is
+in the asset, and its m_Name (None if it has none). `signature` is the bundle
+signature of the file, or None for asset files.
+"""
+
+
+class Catalog:
+	def __init__(self, path, names=False):
+		"""
+		Open (or create) the catalog at `path`. If `names` is set, the
+		m_Name of every object is read and recorded when files are added.
+		"""
+		self.path = path
+		self.names = names
+		self._lock = Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.executescript(SCHEMA)
+
+	def __repr__(self):
+		return "<%s %r>" % (self.__class__.__name__, self.path)
+
+	def close(self):
+		self.db.close()
+
+	def _stat(self, path):
+		path = os.path.abspath(path)
+		st = os.stat(path)
+		return path, st.st_size, st.st_mtime
+
+	def is_current(self, path):
+		"""
+		Return True if the catalog has an entry for the file at `path`
+		matching its current size and modification time.
+		"""
+		path, size, mtime = self._stat(path)
+		with self._lock:
+			row = self.db.execute(
+				"SELECT size, mtime FROM files WHERE path = ?", (path, )
+			).fetchone()
+		return row is not None and row[0] == size and row[1] == mtime
+
+	def add_bundle(self, bundle, force=False):
+		"""
+		Record the assets of `bundle`, unless the catalog is current for
+		its file (or `force` is set).
+		"""
+		nodes = {node.name: (node.offset, node.size) for node in bundle.nodes}
+		self._add(bundle.path, bundle.signature, bundle.assets, nodes, force)
+
+	def add_asset(self, asset, force=False):
+		"""
+		Record the standalone asset file `asset`, unless the catalog is
+		current for its file (or `force` is set).
+		"""
+		self._add(asset.name, None, [asset], {}, force)
+
+	def _add(self, path, signature, assets, nodes, force):
+		if not force and self.is_current(path):
+			return
+		path, size, mtime = self._stat(path)
+
+		rows = []
+		for asset in assets:
+			objects = []
+			refs = []
+			if not asset.is_resource:
+				for path_id, obj in asset.objects.items():
+					name = obj.read_name() if self.names else None
+					objects.append((
+						path_id, obj.class_id, obj.type_id, obj.data_offset, obj.size, name
+					))
+				for file_id, ref in enumerate(asset.asset_refs[1:], 1):
+					refs.append((file_id, ref.file_path, str(ref.guid)))
+			node_offset, node_size = nodes.get(asset.name, (None, None))
+			rows.append((asset, node_offset, node_size, objects, refs))
+
+		with self._lock, self.db:
+			self.db.execute("DELETE FROM files WHERE path = ?", (path, ))
+			file_id = self.db.execute(
+				"INSERT INTO files (path, size, mtime, signature) VALUES (?, ?, ?, ?)",
+				(path, size, mtime, signature)
+			).lastrowid
+			for asset, node_offset, node_size, objects, refs in rows:
+				asset_id = self.db.execute(
+					"INSERT INTO assets (file_id, name, format, node_offset, node_size, named) "
+					"VALUES (?, ?, ?, ?, ?, ?)",
+					(
+						file_id, asset.name, getattr(asset, "format", None), node_offset, node_size,
+						self.names or asset.is_resource
+					)
+				).lastrowid
+				self.db.executemany(
+					"INSERT INTO objects (asset_id, path_id, class_id, type_id, data_offset, size, name) "
+					"VALUES (%i, ?, ?, ?, ?, ?, ?)" % (asset_id), objects
+				)
+				self.db.executemany(
+					"INSERT INTO refs (asset_id, file_id, path, guid) VALUES (%i, ?, ?, ?)" % (asset_id),
+					refs
+				)
+
+	def add_names(self, path, asset):
+		"""
+		Record the m_Name of the objects of `asset`, in the file at `path`,
+		if they weren't yet.
+		"""
+		with self._lock:
+			row = self.db.execute(
+				"SELECT assets.id FROM assets JOIN files ON assets.file_id = files.id "
+				"WHERE files.path = ? AND assets.name = ? AND NOT assets.named",
+				(os.path.abspath(path), asset.name)
+			).fetchone()
+		if row is None:
+			return
+
+		names = []
+		for path_id, obj in asset.objects.items():
+			name = obj.read_name()
+			if name is not None:
+				names.append((name, path_id))
+		with self._lock, self.db:
+			self.db.executemany(
+				"UPDATE objects SET name = ? WHERE asset_id = %i AND path_id = ?" % (row[0]), names
+			)
+			self.db.execute("UPDATE assets SET named = 1 WHERE id = ?", (row[0], ))
+
+	def remove(self, path):
+		with self._lock, self.db:
+			self.db.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path), ))
+
+	def files(self):
+		"""
+		Return the paths of the files in the catalog.
+		"""
+		with self._lock:
+			return [row[0] for row in self.db.execute("SELECT path FROM files ORDER BY path")]
+
+	def find(self, name=None, class_id=None, path_id=None, asset=None):
+		"""
+		Return the CatalogEntry of every object matching all the given
+		criteria: its m_Name, class id, path_id and asset name. Names only
+		match in the assets whose names were recorded.
+		"""
+		query = (
+			"SELECT files.path, files.signature, assets.name, objects.path_id, objects.class_id, "
+			"objects.type_id, objects.data_offset, objects.size, objects.name "
+			"FROM objects JOIN assets ON objects.asset_id = assets.id "
+			"JOIN files ON assets.file_id = files.id"
+		)
+		conditions = []
+		args = []
+		for column, value in (
+			("objects.name", name), ("objects.class_id", class_id),
+			("objects.path_id", path_id), ("assets.name", asset),
+		):
+			if value is not None:
+				conditions.append(column + " = ?")
+				args.append(value)
+		if conditions:
+			query += " WHERE " + " AND ".join(conditions)
+
+		with self._lock:
+			return [CatalogEntry(*row) for row in self.db.execute(query, args)]
+
+	def find_asset(self, name):
+		"""
+		Return the `(path, signature)` of the files containing an asset
+		called `name` (case-insensitively).
+		"""
+		with self._lock:
+			return self.db.execute(
+				"SELECT files.path, files.signature FROM assets "
+				"JOIN files ON assets.file_id = files.id WHERE lower(assets.name) = ?",
+				(name.lower(), )
+			).fetchall()
+
+	def get_refs(self, path, asset):
+		"""
+		Return the external references of `asset` in the file at `path`,
+		as a list of `(file_id, path, guid)` tuples.
+		"""
+		with self._lock:
+			return self.db.execute(
+				"SELECT refs.file_id, refs.path, refs.guid FROM refs "
+				"JOIN assets ON refs.asset_id = assets.id "
+				"JOIN files ON assets.file_id = files.id "
+				"WHERE files.path = ? AND assets.name = ? ORDER BY refs.file_id",
+				(os.path.abspath(path), asset)
+			).fetchall()
@@ -0,0 +1,1018 @@
+"""
+Compile TypeTrees into specialized decoder functions.
+
+ObjectInfo.read_value interprets a TypeTree node by node for every object it
+reads. The compiler in this module walks a tree once and produces a decoder
+closure which reproduces the interpreter's output, with runs of fixed-size
+fields merged into a single precompiled struct.Struct unpack.
+
+A decoder is called as `decoder(data, pos, obj)` and returns `(value, pos)`,
+where `data` is the object's bytes and `obj` the ObjectInfo being read.
+
+Arrays are decoded to lists by default. In the "array" mode, arrays of
+numbers are decoded to array.array objects instead; in the "numpy" mode,
+arrays of numbers and of fixed-layout structs (Vector3f, keyframes, ...)
+are decoded in a single pass to NumPy (structured) arrays. Arrays which
+cannot be decoded that way are still decoded to lists.
+
+The fields of a struct can also be compiled one by one (see get_fields), along
+with skip functions which find the end of a field without decoding it. These
+are also used by projections (see get_projection), which only decode some of
+the fields of a struct.
+"""
+import math
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from . import engine as UnityEngine
+from .utils import MemoryReader
+
+
+PRIMITIVES = {
+	"bool": "b",
+	"SInt8": "b",
+	"UInt8": "B",
+	"SInt16": "h",
+	"UInt16": "H",
+	"SInt64": "q",
+	"UInt64": "q",
+	"UInt32": "I",
+	"unsigned int": "I",
+	"SInt32": "i",
+	"int": "i",
+	"float": "f",
+	"double": "d",
+}
+
+# Types which are aligned to 4 bytes before being read
+PRE_ALIGNED = ("float", "double")
+
+BYTE_ARRAYS = ("char", "UInt8")
+
+ARRAY_MODES = ("list", "array", "numpy")
+
+NUMPY_TYPES = {
+	"SInt8": "i1",
+	"UInt8": "u1",
+	"SInt16": "<i2",
+	"UInt16": "<u2",
+	"SInt64": "<i8",
+	"UInt64": "<i8",
+	"UInt32": "<u4",
+	"unsigned int": "<u4",
+	"SInt32": "<i4",
+	"int": "<i4",
+	"float": "<f4",
+	"double": "<f8",
+}
+
+UINT32 = struct.Struct("<I")
+
+
+def _array_typecode(fmt):
+	# array.array typecodes are sized per platform
+	size = struct.calcsize(fmt)
+	for typecode in {"i": "ilq", "I": "ILQ", "q": "qlL"}.get(fmt, fmt):
+		if array(typecode).itemsize == size:
+			return typecode
+
+
+ARRAY_TYPECODES = {fmt: _array_typecode(fmt) for fmt in "bBhHiIqfd"}
+
+
+def _get_compiled(tree, key, compile):
+	try:
+		decoders = tree._decoders
+	except AttributeError:
+		decoders = tree._decoders = {}
+	if key not in decoders:
+		decoders[key] = compile(tree)
+	return decoders[key]
+
+
+def get_decoder(tree, format, array_mode="list"):
+	"""
+	Return the compiled decoder for tree, compiling it on first use.
+	Decoders are cached on the tree itself, so trees shared between objects
+	of the same type (and hash) share their decoder.
+	"""
+	compiler = DecoderCompiler(format, array_mode)
+	return _get_compiled(tree, (format, array_mode), compiler.compile)
+
+
+def get_fields(tree, format, array_mode="list"):
+	"""
+	Return a `(fields, finish)` tuple for the struct tree, where fields is
+	a list of its compiled Fields and finish(result, obj) turns a mapping
+	of decoded fields into its engine class. Return None if tree is not
+	a struct. Cached like get_decoder().
+	"""
+	compiler = DecoderCompiler(format, array_mode)
+	return _get_compiled(tree, (format, array_mode, "fields"), compiler.compile_fields)
+
+
+def get_projection(tree, format, fields, array_mode="list"):
+	"""
+	Return a decoder for tree which only decodes `fields`, a sequence of
+	field names or dotted paths to fields of nested structs (such as
+	"m_StreamData.path"). The other fields are skipped. Cached like
+	get_decoder().
+	"""
+	fields = tuple(fields)
+	compiler = DecoderCompiler(format, array_mode)
+
+	def compile(tree):
+		return compiler.compile_projection(tree, fields)
+	return _get_compiled(tree, (format, array_mode, "projection", fields), compile)
+
+
+def _is_scalar(node):
+	t = node.type
+	return t in PRIMITIVES or t in ("string", "pair") or t.startswith("PPtr<")
+
+
+def _is_array(node):
+	return node.is_array or bool(node.children and node.children[0].is_array)
+
+
+def is_struct(node):
+	return not _is_scalar(node) and not _is_array(node)
+
+
+def is_byte_array(node):
+	if _is_scalar(node) or not _is_array(node):
+		return False
+	array = node if node.is_array else node.children[0]
+	return array.children[1].type in BYTE_ARRAYS
+
+
+class FixedLayout:
+	"""
+	The flattened layout of a fixed-size TypeTree node.
+	`fmt` is a struct format (without byte order), `build` turns an iterator
+	over the unpacked values into the decoded value (None meaning the next
+	value is used as is), `phase` is the position modulo 4 after the node
+	(None if unknown) and `aligned` is set if the layout depends on the
+	position it starts at.
+	"""
+	def __init__(self, fmt, build, phase, aligned):
+		self.fmt = fmt
+		self.build = build
+		self.phase = phase
+		self.aligned = aligned
+
+	@property
+	def size(self):
+		return struct.calcsize("<" + self.fmt)
+
+
+def _pad(phase):
+	return "x" * (-phase % 4)
+
+
+def _advance(phase, size):
+	if phase is None:
+		return None
+	return (phase + size) % 4
+
+
+def _bool(it, obj):
+	return bool(next(it))
+
+
+def _exposed_name(it, obj):
+	next(it)
+	return ""
+
+
+def _skip_by(advance):
+	def skip(data, pos, obj):
+		return pos + advance
+	return skip
+
+
+class Field:
+	"""
+	A field of a struct, compiled to be decoded on its own.
+	`read(data, pos, obj)` decodes it as a decoder does, `skip(data, pos, obj)`
+	returns the position after it without decoding it.
+	"""
+	def __init__(self, node, read, skip):
+		self.node = node
+		self.name = node.name
+		self.read = read
+		self.skip = skip
+		self.is_byte_array = is_byte_array(node)
+
+	def __repr__(self):
+		return "<%s %s>" % (self.__class__.__name__, self.name)
+
+
+class DecoderCompiler:
+	def __init__(self, format, array_mode="list"):
+		if array_mode not in ARRAY_MODES:
+			raise ValueError("Unknown array mode: %r" % (array_mode))
+		self.format = format
+		self.array_mode = array_mode
+		# ObjectPointer ids are read through Asset.read_id
+		self.id_format = "q" if format >= 14 else "i"
+		if array_mode == "numpy":
+			try:
+				import numpy
+			except ImportError:
+				raise RuntimeError("numpy is required to decode arrays in the 'numpy' mode")
+			self.numpy = numpy
+
+	def compile(self, tree):
+		reader, phase = self.reader(tree, 0, False)
+		return reader
+
+	def compile_fields(self, tree):
+		if not is_struct(tree):
+			return None
+		exposed = tree.type.startswith("ExposedReference")
+		phase = 0
+		fields = []
+		for child in tree.children:
+			reader = self.reader(child, phase, exposed)[0]
+			skip, phase = self.skipper(child, phase, exposed)
+			fields.append(Field(child, reader, skip))
+		return fields, self.finisher(tree)
+
+	def fixed(self, node, phase, exposed):
+		"""
+		Return the FixedLayout of node when starting at phase, or None if
+		the node has a variable size (or cannot be laid out statically).
+		"""
+		t = node.type
+		if exposed and node.name == "exposedName":
+			return FixedLayout("I", _exposed_name, _advance(phase, 4), False)
+
+		if t in PRIMITIVES:
+			fmt = PRIMITIVES[t]
+			aligned = False
+			if t in PRE_ALIGNED:
+				if phase is None:
+					return None
+				fmt = _pad(phase) + fmt
+				aligned = True
+			build = _bool if t == "bool" else None
+			layout = FixedLayout(fmt, build, None, aligned)
+		elif t == "string":
+			return None
+		elif t.startswith("PPtr<"):
+			layout = FixedLayout("i" + self.id_format, self.pointer_builder(node), None, False)
+		elif node.is_array or (node.children and node.children[0].is_array):
+			return None
+		elif t == "pair":
+			if len(node.children) != 2:
+				return None
+			layout = self.fixed_children(node.children, phase, exposed)
+			if layout is None:
+				return None
+			first, second = layout.build
+			layout.build = self.pair_builder(first, second)
+		else:
+			exposed = exposed or t.startswith("ExposedReference")
+			layout = self.fixed_children(node.children, phase, exposed)
+			if layout is None:
+				return None
+			names = [child.name for child in node.children]
+			builds = layout.build
+			layout.build = self.struct_builder(node, list(zip(names, builds)), exposed)
+
+		# The interpreter raises if it reads less than the node's size
+		size = layout.size
+		if node.size > 0 and size < node.size:
+			return None
+
+		if t in PRIMITIVES or t.startswith("PPtr<"):
+			layout.phase = _advance(phase, size)
+		if node.post_align:
+			if layout.phase is None:
+				return None
+			layout.fmt += _pad(layout.phase)
+			layout.phase = 0
+			layout.aligned = True
+		return layout
+
+	def fixed_children(self, children, phase, exposed):
+		fmt = []
+		builds = []
+		aligned = False
+		for child in children:
+			layout = self.fixed(child, phase, exposed)
+			if layout is None:
+				return None
+			fmt.append(layout.fmt)
+			builds.append(layout.build)
+			aligned = aligned or layout.aligned
+			phase = layout.phase
+		return FixedLayout("".join(fmt), builds, phase, aligned)
+
+	def pointer_builder(self, node):
+		from .object import ObjectPointer
+
+		def build(it, obj):
+			ret = ObjectPointer(node, obj.asset)
+			ret.file_id = next(it)
+			ret.path_id = next(it)
+			if not ret:
+				return None
+			return ret
+		return build
+
+	def pair_builder(self, first, second):
+		def build(it, obj):
+			a = next(it) if first is None else first(it, obj)
+			b = next(it) if second is None else second(it, obj)
+			return (a, b)
+		return build
+
+	def struct_builder(self, node, fields, exposed):
+		finish = self.finisher(node)
+
+		def build(it, obj):
+			result = OrderedDict()
+			for name, b in fields:
+				result[name] = next(it) if b is None else b(it, obj)
+			return finish(result, obj)
+		return build
+
+	def finisher(self, node):
+		"""
+		Return a function which turns a decoded OrderedDict into its engine
+		class, as load_object() does.
+		"""
+		t = node.type
+		if not hasattr(UnityEngine, t):
+			return lambda result, obj: result
+		cls = getattr(UnityEngine, t)
+
+		if t.startswith("ExposedReference"):
+			return lambda result, obj: cls(result)
+		elif t == "StreamedResource":
+			def finish(result, obj):
+				result = cls(result)
+				result.asset = obj.resolve_streaming_asset(result.source)
+				return result
+		elif t == "StreamingInfo":
+			def finish(result, obj):
+				result = cls(result)
+				result.asset = obj.resolve_streaming_asset(result.path)
+				return result
+		else:
+			return lambda result, obj: cls(result)
+		return finish
+
+	def reader(self, node, phase, exposed):
+		"""
+		Return a `(reader, phase)` tuple for node starting at phase.
+		"""
+		layout = self.fixed(node, phase, exposed)
+		if layout is not None:
+			return self.fixed_reader(layout), layout.phase
+
+		t = node.type
+		if t in PRIMITIVES:
+			if node.size > struct.calcsize(PRIMITIVES[t]):
+				return self.fallback(node, exposed), None
+			return self.primitive_reader(node)
+		elif t == "string":
+			if not node.children:
+				return self.fallback(node, exposed), None
+			return self.string_reader(node)
+		elif t.startswith("PPtr<"):
+			return self.fallback(node, exposed), None
+		elif node.is_array or (node.children and node.children[0].is_array):
+			if node.size > 0:
+				return self.fallback(node, exposed), None
+			return self.array_reader(node, phase, exposed)
+		elif t == "pair":
+			if len(node.children) != 2 or node.size > 0:
+				return self.fallback(node, exposed), None
+			return self.pair_reader(node, phase, exposed)
+		else:
+			return self.struct_reader(node, phase, exposed or t.startswith("ExposedReference"))
+
+	def fixed_reader(self, layout):
+		advance = layout.size
+		# Trailing padding may run past the end of the data; don't unpack it.
+		unpack_from = struct.Struct("<" + layout.fmt.rstrip("x")).unpack_from
+		build = layout.build
+
+		if build is None:
+			def read(data, pos, obj):
+				return unpack_from(data, pos)[0], pos + advance
+		else:
+			def read(data, pos, obj):
+				return build(iter(unpack_from(data, pos)), obj), pos + advance
+		return read
+
+	def fallback(self, node, exposed):
+		"""
+		Return a reader which defers to ObjectInfo.read_value for node.
+		"""
+		from .object import ExposedReferenceInfo
+
+		def read(data, pos, obj):
+			if exposed:
+				obj = ExposedReferenceInfo(obj.asset)
+			buf = MemoryReader(data, offset=pos)
+			return obj.read_value(node, buf), buf.tell()
+		return read
+
+	def primitive_reader(self, node):
+		t = node.type
+		unpack_from = struct.Struct("<" + PRIMITIVES[t]).unpack_from
+		size = struct.calcsize(PRIMITIVES[t])
+		pre_align = t in PRE_ALIGNED
+		post_align = node.post_align
+		cast = bool if t == "bool" else None
+
+		def read(data, pos, obj):
+			if pre_align:
+				pos = (pos + 3) & -4
+			value = unpack_from(data, pos)[0]
+			pos += size
+			if post_align:
+				pos = (pos + 3) & -4
+			if cast is not None:
+				value = cast(value)
+			return value, pos
+		return read, (0 if pre_align or post_align else None)
+
+	def string_reader(self, node):
+		fixed_size = node.size if node.size != -1 else None
+		align = node.children[0].post_align or node.post_align
+		unpack_size = UINT32.unpack_from
+
+		def read(data, pos, obj):
+			if fixed_size is None:
+				size = unpack_size(data, pos)[0]
+				pos += 4
+			else:
+				size = fixed_size
+			value = bytes(data[pos:pos + size])
+			if len(value) != size:
+				raise struct.error("unpack requires a buffer of %i bytes" % (size))
+			pos += size
+			try:
+				value = value.decode("utf-8")
+			except UnicodeDecodeError:
+				pass
+			if align:
+				pos = (pos + 3) & -4
+			return value, pos
+		return read, (0 if align else None)
+
+	def array_reader(self, node, phase, exposed):
+		array = node if node.is_array else node.children[0]
+		align = array.post_align or node.post_align
+		element = array.children[1]
+		unpack_size = UINT32.unpack_from
+
+		if element.type in BYTE_ARRAYS:
+			def read(data, pos, obj):
+				size = unpack_size(data, pos)[0]
+				pos += 4
+				value = bytes(data[pos:pos + size])
+				pos += size
+				if align:
+					pos = (pos + 3) & -4
+				return value, pos
+			return read, (0 if align else None)
+
+		# The size prefix is 4 bytes, so the elements start at the same phase
+		layout = self.fixed(element, phase, exposed)
+		if layout is not None and (layout.aligned and layout.size % 4):
+			# Each element would start at a different phase
+			layout = None
+
+		if layout is not None:
+			read = None
+			if self.array_mode == "array":
+				read = self.typed_array_reader(layout, align)
+			elif self.array_mode == "numpy":
+				read = self.numpy_array_reader(element, phase, layout, align)
+			if read is None:
+				read = self.fixed_array_reader(layout, align)
+			if align:
+				phase = 0
+			elif layout.size % 4:
+				phase = None
+		else:
+			read = self.variable_array_reader(self.reader(element, None, exposed)[0], align)
+			phase = 0 if align else None
+		return read, phase
+
+	def fixed_array_reader(self, layout, align):
+		unpack_size = UINT32.unpack_from
+		fmt = layout.fmt
+		build = layout.build
+		item_size = layout.size
+
+		if build is None and len(fmt) == 1:
+			# Arrays of plain primitives unpack in a single call
+			def read(data, pos, obj):
+				size = unpack_size(data, pos)[0]
+				pos += 4
+				value = list(struct.unpack_from("<%i%s" % (size, fmt), data, pos))
+				pos += size * item_size
+				if align:
+					pos = (pos + 3) & -4
+				return value, pos
+			return read
+
+		if fmt.endswith("x"):
+			# Trailing padding of the last element may be missing
+			item = struct.Struct("<" + fmt.rstrip("x"))
+
+			def read(data, pos, obj):
+				size = unpack_size(data, pos)[0]
+				pos += 4
+				value = []
+				for i in range(size):
+					values = item.unpack_from(data, pos)
+					value.append(values[0] if build is None else build(iter(values), obj))
+					pos += item_size
+				if align:
+					pos = (pos + 3) & -4
+				return value, pos
+			return read
+
+		item = struct.Struct("<" + fmt)
+
+		def read(data, pos, obj):
+			size = unpack_size(data, pos)[0]
+			pos += 4
+			end = pos + size * item_size
+			items = item.iter_unpack(memoryview(data)[pos:end])
+			if build is None:
+				value = [values[0] for values in items]
+			else:
+				value = [build(iter(values), obj) for values in items]
+			pos = end
+			if align:
+				pos = (pos + 3) & -4
+			return value, pos
+		return read
+
+	def typed_array_reader(self, layout, align):
+		"""
+		Return a reader decoding arrays of numbers to array.array, or None
+		if the elements are not plain numbers.
+		"""
+		if layout.build is not None or len(layout.fmt) != 1:
+			return None
+		typecode = ARRAY_TYPECODES[layout.fmt]
+		item_size = layout.size
+		swap = sys.byteorder != "little"
+		unpack_size = UINT32.unpack_from
+
+		def read(data, pos, obj):
+			size = unpack_size(data, pos)[0]
+			pos += 4
+			end = pos + size * item_size
+			if end > len(data):
+				raise struct.error("unpack requires a buffer of %i bytes" % (end - pos))
+			value = array(typecode)
+			value.frombytes(data[pos:end])
+			if swap:
+				value.byteswap()
+			pos = end
+			if align:
+				pos = (pos + 3) & -4
+			return value, pos
+		return read
+
+	def numpy_array_reader(self, element, phase, layout, align):
+		"""
+		Return a reader decoding arrays of numbers or of fixed-layout structs
+		to NumPy arrays, or None if the elements can't be represented as such.
+		"""
+		if layout.fmt.endswith("x"):
+			return None
+		dtype = self.numpy_dtype(element, phase)
+		if dtype is None:
+			return None
+		dtype, offset, size, phase = dtype
+		if offset or size != layout.size:
+			return None
+		frombuffer = self.numpy.frombuffer
+		unpack_size = UINT32.unpack_from
+
+		def read(data, pos, obj):
+			size = unpack_size(data, pos)[0]
+			pos += 4
+			value = frombuffer(data, dtype=dtype, count=size, offset=pos).copy()
+			pos += value.nbytes
+			if align:
+				pos = (pos + 3) & -4
+			return value, pos
+		return read
+
+	def numpy_dtype(self, node, phase):
+		"""
+		Return a `(dtype, offset, size, phase)` tuple describing node as a
+		NumPy dtype at `offset` in `size` bytes, or None if it can't be.
+		"""
+		t = node.type
+		if t in NUMPY_TYPES:
+			dtype = self.numpy.dtype(NUMPY_TYPES[t])
+			offset = 0
+			if t in PRE_ALIGNED:
+				if phase is None:
+					return None
+				offset = -phase % 4
+			size = offset + dtype.itemsize
+			phase = _advance(phase, size)
+		elif t in PRIMITIVES or t == "string" or t == "pair" or t.startswith("PPtr<"):
+			return None
+		elif node.is_array or (node.children and node.children[0].is_array):
+			return None
+		elif hasattr(UnityEngine, t) or t.startswith("ExposedReference") or not node.children:
+			return None
+		else:
+			names, formats, offsets = [], [], []
+			size = 0
+			for child in node.children:
+				field = self.numpy_dtype(child, phase)
+				if field is None or child.name in names:
+					return None
+				dtype, child_offset, child_size, phase = field
+				names.append(child.name)
+				formats.append(dtype)
+				offsets.append(size + child_offset)
+				size += child_size
+			dtype = None
+			offset = 0
+
+		if node.post_align:
+			if phase is None:
+				return None
+			size += -phase % 4
+			phase = 0
+		if dtype is None:
+			dtype = self.numpy.dtype({
+				"names": names, "formats": formats, "offsets": offsets, "itemsize": size,
+			})
+		return dtype, offset, size, phase
+
+	def variable_array_reader(self, element_reader, align):
+		unpack_size = UINT32.unpack_from
+
+		def read(data, pos, obj):
+			size = unpack_size(data, pos)[0]
+			pos += 4
+			value = []
+			for i in range(size):
+				item, pos = element_reader(data, pos, obj)
+				value.append(item)
+			if align:
+				pos = (pos + 3) & -4
+			return value, pos
+		return read
+
+	def pair_reader(self, node, phase, exposed):
+		first, phase = self.reader(node.children[0], phase, exposed)
+		second, phase = self.reader(node.children[1], phase, exposed)
+		post_align = node.post_align
+
+		def read(data, pos, obj):
+			a, pos = first(data, pos, obj)
+			b, pos = second(data, pos, obj)
+			if post_align:
+				pos = (pos + 3) & -4
+			return (a, b), pos
+		return read, (0 if post_align else phase)
+
+	def struct_reader(self, node, phase, exposed):
+		steps = []
+		run = []
+		run_phase = phase
+
+		def flush():
+			if run:
+				steps.append(self.run_step(run, run_phase))
+				del run[:]
+
+		for child in node.children:
+			layout = self.fixed(child, phase, exposed)
+			if layout is not None:
+				if not run:
+					run_phase = phase
+				run.append((child.name, layout))
+				phase = layout.phase
+			else:
+				flush()
+				reader, phase = self.reader(child, phase, exposed)
+				steps.append(self.field_step(child.name, reader))
+		flush()
+
+		finish = self.finisher(node)
+		expected_size = node.size
+		post_align = node.post_align
+
+		def read(data, pos, obj):
+			start = pos
+			result = OrderedDict()
+			for step in steps:
+				pos = step(data, pos, obj, result)
+			if expected_size > 0 and pos - start < expected_size:
+				raise ValueError("Expected read_value(%r) to read %r bytes, but only read %r bytes" % (
+					node, expected_size, pos - start
+				))
+			if post_align:
+				pos = (pos + 3) & -4
+			return finish(result, obj), pos
+		return read, (0 if post_align else phase)
+
+	def compile_projection(self, tree, fields):
+		if not is_struct(tree):
+			return self.compile(tree)
+
+		# Turn the paths into a tree of wanted fields, None meaning all of it
+		wanted = {}
+		for path in fields:
+			node = wanted
+			*parents, name = path.split(".")
+			for parent in parents:
+				node = node.setdefault(parent, {})
+				if node is None:
+					break
+			else:
+				node[name] = None
+
+		exposed = tree.type.startswith("ExposedReference")
+		reader, phase = self.projection_reader(tree, 0, exposed, wanted, False)
+		finish = self.finisher(tree)
+
+		def read(data, pos, obj):
+			result, pos = reader(data, pos, obj)
+			return finish(result, obj), pos
+		return read
+
+	def projection_reader(self, node, phase, exposed, wanted, complete):
+		"""
+		Return a `(reader, phase)` tuple for the struct node which only decodes
+		its `wanted` fields to an OrderedDict. Unless `complete` is set, the
+		reader stops after the last wanted field and the position it returns
+		is meaningless.
+		"""
+		names = [child.name for child in node.children]
+		last = max((i for i, name in enumerate(names) if name in wanted), default=-1)
+		steps = []
+		advance = 0
+		for i, child in enumerate(node.children):
+			if i > last and not complete:
+				break
+			if child.name not in wanted:
+				layout = self.fixed(child, phase, exposed)
+				if layout is not None:
+					# Runs of skipped fixed-size fields are skipped in one step
+					advance += layout.size
+					phase = layout.phase
+					continue
+				skip, phase = self.skipper(child, phase, exposed)
+				step = self.skip_step(skip)
+			else:
+				subfields = wanted[child.name]
+				if subfields is None or not is_struct(child):
+					reader, phase = self.reader(child, phase, exposed)
+				else:
+					reader, phase = self.projection_reader(
+						child, phase, exposed or child.type.startswith("ExposedReference"),
+						subfields, complete or i < last
+					)
+				step = self.field_step(child.name, reader)
+			if advance:
+				steps.append(self.skip_step(_skip_by(advance)))
+				advance = 0
+			steps.append(step)
+		if advance:
+			steps.append(self.skip_step(_skip_by(advance)))
+
+		post_align = node.post_align
+
+		def read(data, pos, obj):
+			result = OrderedDict()
+			for step in steps:
+				pos = step(data, pos, obj, result)
+			if post_align:
+				pos = (pos + 3) & -4
+			return result, pos
+		return read, (0 if post_align else phase)
+
+	def skip_step(self, skip):
+		def step(data, pos, obj, result):
+			return skip(data, pos, obj)
+		return step
+
+	def skipper(self, node, phase, exposed):
+		"""
+		Return a `(skip, phase)` tuple for node starting at phase, where
+		`skip(data, pos, obj)` returns the position after node. Arrays and
+		strings are skipped over using their size, without decoding them.
+		"""
+		layout = self.fixed(node, phase, exposed)
+		if layout is not None:
+			return _skip_by(layout.size), layout.phase
+
+		t = node.type
+		if t in PRIMITIVES:
+			size = struct.calcsize(PRIMITIVES[t])
+			if node.size > size:
+				return self.fallback_skipper(node, phase, exposed)
+			pre_align = t in PRE_ALIGNED
+			post_align = node.post_align
+
+			def skip(data, pos, obj):
+				if pre_align:
+					pos = (pos + 3) & -4
+				pos += size
+				if post_align:
+					pos = (pos + 3) & -4
+				return pos
+			return skip, (0 if pre_align or post_align else None)
+		elif t == "string":
+			if not node.children:
+				return self.fallback_skipper(node, phase, exposed)
+			fixed_size = node.size if node.size != -1 else None
+			align = node.children[0].post_align or node.post_align
+			unpack_size = UINT32.unpack_from
+
+			def skip(data, pos, obj):
+				if fixed_size is None:
+					pos += 4 + unpack_size(data, pos)[0]
+				else:
+					pos += fixed_size
+				if align:
+					pos = (pos + 3) & -4
+				return pos
+			return skip, (0 if align else None)
+		elif t.startswith("PPtr<"):
+			return self.fallback_skipper(node, phase, exposed)
+		elif node.is_array or (node.children and node.children[0].is_array):
+			if node.size > 0:
+				return self.fallback_skipper(node, phase, exposed)
+			return self.array_skipper(node, phase, exposed)
+		elif t == "pair":
+			if len(node.children) != 2 or node.size > 0:
+				return self.fallback_skipper(node, phase, exposed)
+			steps = []
+			for child in node.children:
+				step, phase = self.skipper(child, phase, exposed)
+				steps.append(step)
+			return self.sequence_skipper(steps, node.post_align), (0 if node.post_align else phase)
+		else:
+			return self.struct_skipper(node, phase, exposed or t.startswith("ExposedReference"))
+
+	def fallback_skipper(self, node, phase, exposed):
+		reader, phase = self.reader(node, phase, exposed)
+
+		def skip(data, pos, obj):
+			return reader(data, pos, obj)[1]
+		return skip, phase
+
+	def array_skipper(self, node, phase, exposed):
+		array = node if node.is_array else node.children[0]
+		align = array.post_align or node.post_align
+		element = array.children[1]
+		unpack_size = UINT32.unpack_from
+
+		if element.type in BYTE_ARRAYS:
+			item_size = 1
+			layout = None
+		else:
+			layout = self.fixed(element, phase, exposed)
+			if layout is not None and (layout.aligned and layout.size % 4):
+				layout = None
+			if layout is not None:
+				item_size = layout.size
+
+		if element.type in BYTE_ARRAYS or layout is not None:
+			def skip(data, pos, obj):
+				pos += 4 + unpack_size(data, pos)[0] * item_size
+				if align:
+					pos = (pos + 3) & -4
+				return pos
+			if align:
+				phase = 0
+			elif item_size % 4:
+				phase = None
+			return skip, phase
+
+		skip_element = self.skipper(element, None, exposed)[0]
+
+		def skip(data, pos, obj):
+			size = unpack_size(data, pos)[0]
+			pos += 4
+			for i in range(size):
+				pos = skip_element(data, pos, obj)
+			if align:
+				pos = (pos + 3) & -4
+			return pos
+		return skip, (0 if align else None)
+
+	def struct_skipper(self, node, phase, exposed):
+		steps = []
+		advance = 0
+		for child in node.children:
+			layout = self.fixed(child, phase, exposed)
+			if layout is not None:
+				# Runs of fixed-size fields are skipped in one step
+				advance += layout.size
+				phase = layout.phase
+				continue
+			if advance:
+				steps.append(_skip_by(advance))
+				advance = 0
+			step, phase = self.skipper(child, phase, exposed)
+			steps.append(step)
+		if advance:
+			steps.append(_skip_by(advance))
+		return self.sequence_skipper(steps, node.post_align), (0 if node.post_align else phase)
+
+	def sequence_skipper(self, steps, post_align):
+		if len(steps) == 1 and not post_align:
+			return steps[0]
+
+		def skip(data, pos, obj):
+			for step in steps:
+				pos = step(data, pos, obj)
+			if post_align:
+				pos = (pos + 3) & -4
+			return pos
+		return skip
+
+	def field_step(self, name, reader):
+		def step(data, pos, obj, result):
+			result[name], pos = reader(data, pos, obj)
+			return pos
+		return step
+
+	def run_step(self, run, phase):
+		"""
+		Merge a run of fixed-size fields into a single struct unpack.
+		"""
+		layout = FixedLayout("".join(l.fmt for name, l in run), None, None, False)
+		advance = layout.size
+		unpack_from = struct.Struct("<" + layout.fmt.rstrip("x")).unpack_from
+		fields = [(name, l.build) for name, l in run]
+
+		if all(build is None for name, build in fields):
+			names = [name for name, build in fields]
+
+			def step(data, pos, obj, result):
+				result.update(zip(names, unpack_from(data, pos)))
+				return pos + advance
+			return step
+
+		def step(data, pos, obj, result):
+			it = iter(unpack_from(data, pos))
+			for name, build in fields:
+				result[name] = next(it) if build is None else build(it, obj)
+			return pos + advance
+		return step
+
+
+def _normalize(value):
+	from .engine.object import Object
+	from .object import ObjectPointer
+
+	if isinstance(value, array):
+		return ("list", [_normalize(v) for v in value.tolist()])
+	elif hasattr(value, "dtype") and hasattr(value, "shape"):
+		# NumPy arrays and records
+		if value.dtype.names:
+			if value.shape:
+				return ("list", [_normalize(v) for v in value])
+			return [(name, _normalize(value[name])) for name in value.dtype.names]
+		return _normalize(value.tolist())
+	elif isinstance(value, Object):
+		return (
+			value.__class__.__name__, _normalize(value._obj),
+			id(getattr(value, "asset", None))
+		)
+	elif isinstance(value, ObjectPointer):
+		return ("PPtr", value.type.type, value.file_id, value.path_id)
+	elif isinstance(value, Mapping):
+		return [(k, _normalize(v)) for k, v in value.items()]
+	elif isinstance(value, (list, tuple)):
+		return (value.__class__.__name__, [_normalize(v) for v in value])
+	elif isinstance(value, float) and math.isnan(value):
+		return ("nan", )
+	return (value.__class__.__name__, value)
+
+
+def check_decoded(obj, result, expected):
+	"""
+	Raise ValueError if result (from a compiled decoder) differs from
+	expected (from the interpreter) for object obj.
+	"""
+	if _normalize(result) != _normalize(expected):
+		raise ValueError("Compiled decoder output for %r does not match read_value()" % (obj))
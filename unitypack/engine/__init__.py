@@ -1,15 +1,61 @@
-from .animation import (
-	Animation, AnimationClip, Animator, AnimatorController, Motion,
-	ParticleAnimator, RuntimeAnimatorController
-)
-from .audio import AudioClip, AudioSource, StreamedResource
-from .component import Behaviour, Component, Transform
-from .font import Font
-from .mesh import Mesh, SubMesh, VertexData, MeshFilter
-from .movie import MovieTexture
-from .object import GameObject
-from .particle import EllipsoidParticleEmitter, MeshParticleEmitter, ParticleEmitter, ParticleSystem
-from .physics import BoxCollider, BoxCollider2D, Collider, Collider2D, Rigidbody2D
-from .renderer import MeshRenderer, ParticleRenderer, ParticleSystemRenderer, Renderer
-from .text import TextAsset, TextMesh, Shader
-from .texture import Material, Sprite, Texture2D, StreamingInfo
+"""
+Engine classes, named after the Unity types which are loaded as them.
+Their modules are only imported when one of their classes is first used.
+"""
+from importlib import import_module
+
+
+CLASSES = {
+	"Animation": "animation",
+	"AnimationClip": "animation",
+	"Animator": "animation",
+	"AnimatorController": "animation",
+	"Motion": "animation",
+	"ParticleAnimator": "animation",
+	"RuntimeAnimatorController": "animation",
+	"AudioClip": "audio",
+	"AudioSource": "audio",
+	"StreamedResource": "audio",
+	"Behaviour": "component",
+	"Component": "component",
+	"Transform": "component",
+	"Font": "font",
+	"Mesh": "mesh",
+	"SubMesh": "mesh",
+	"VertexData": "mesh",
+	"MeshFilter": "mesh",
+	"MovieTexture": "movie",
+	"GameObject": "object",
+	"EllipsoidParticleEmitter": "particle",
+	"MeshParticleEmitter": "particle",
+	"ParticleEmitter": "particle",
+	"ParticleSystem": "particle",
+	"BoxCollider": "physics",
+	"BoxCollider2D": "physics",
+	"Collider": "physics",
+	"Collider2D": "physics",
+	"Rigidbody2D": "physics",
+	"MeshRenderer": "renderer",
+	"ParticleRenderer": "renderer",
+	"ParticleSystemRenderer": "renderer",
+	"Renderer": "renderer",
+	"TextAsset": "text",
+	"TextMesh": "text",
+	"Shader": "text",
+	"Material": "texture",
+	"Sprite": "texture",
+	"Texture2D": "texture",
+	"StreamingInfo": "texture",
+}
+
+
+def __getattr__(name):
+	if name not in CLASSES:
+		raise AttributeError("module %r has no attribute %r" % (__name__, name))
+	cls = getattr(import_module("." + CLASSES[name], __name__), name)
+	globals()[name] = cls
+	return cls
+
+
+def __dir__():
+	return sorted(set(globals()) | set(CLASSES))
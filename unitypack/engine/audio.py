@@ -81,5 +81,4 @@ class StreamedResource(Object):
 		if not self.asset:
 			logging.warning("No data available for StreamedResource")
 			return b""
-		self.asset._buf.seek(self.asset._buf_ofs + self.offset)
-		return self.asset._buf.read(self.size)
+		return bytes(self.asset._buf.read_at(self.asset._buf_ofs + self.offset, self.size))
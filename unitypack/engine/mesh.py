@@ -23,6 +23,7 @@ class Mesh(Object):
 
 
 class SubMesh(Object):
+	base_vertex = field("baseVertex", default=0)
 	first_byte = field("firstByte")
 	first_vertex = field("firstVertex")
 	index_count = field("indexCount")
@@ -1,9 +1,13 @@
 import logging
 from enum import IntEnum
 
+from ..utils import LRUCache
 from .object import Object, field
 
 
+DEFAULT_CRUNCH_CACHE_SIZE = 64 * 1024 * 1024
+
+
 class TextureFormat(IntEnum):
 	Alpha8 = 1
 	ARGB4444 = 2
@@ -97,6 +101,33 @@ IMPLEMENTED_FORMATS = (
 )
 
 
+# The size of the blocks of block compressed formats
+BLOCK_SIZES = {
+	TextureFormat.DXT1: 8,
+	TextureFormat.DXT5: 16,
+	TextureFormat.BC6H: 16,
+	TextureFormat.BC7: 16,
+}
+
+# The size of the pixels of raw formats
+PIXEL_SIZES = {
+	TextureFormat.Alpha8: 1,
+	TextureFormat.ARGB4444: 2,
+	TextureFormat.RGB24: 3,
+	TextureFormat.RGBA32: 4,
+	TextureFormat.ARGB32: 4,
+	TextureFormat.RGB565: 2,
+	TextureFormat.RGBA4444: 2,
+	TextureFormat.BGRA32: 4,
+}
+
+# The formats crunched textures decode to
+CRUNCHED_FORMATS = {
+	TextureFormat.DXT1Crunched: TextureFormat.DXT1,
+	TextureFormat.DXT5Crunched: TextureFormat.DXT5,
+}
+
+
 class Sprite(Object):
 	border = field("m_Border")
 	extrude = field("m_Extrude")
@@ -129,6 +160,9 @@ class Texture(Object):
 
 
 class Texture2D(Texture):
+	# Decoded mip levels of crunched textures, by their data and level
+	crunch_cache = LRUCache(DEFAULT_CRUNCH_CACHE_SIZE)
+
 	data = field("image data")
 	lightmap_format = field("m_LightmapFormat")
 	texture_settings = field("m_TextureSettings")
@@ -148,47 +182,252 @@ class Texture2D(Texture):
 
 	@property
 	def image_data(self):
+		return bytes(self._image_view)
+
+	@property
+	def _image_view(self):
+		# The image data, as a view of the asset's buffer if it is streamed
 		if self.stream_data and self.stream_data.asset:
 			if not hasattr(self, "_data"):
-				self._data = self.stream_data.get_data()
+				self._data = self.stream_data._get_view()
 			return self._data
 		return self.data
 
+	@property
+	def mip_count(self):
+		if "m_MipCount" in self._obj:
+			return self._obj["m_MipCount"]
+		if self.mipmap:
+			return max(self.width, self.height, 1).bit_length()
+		return 1
+
+	def mip_level_for(self, size):
+		"""
+		Return the smallest mip level at least `size` pixels wide (or the
+		top one, if the texture is narrower than that).
+		"""
+		level = 0
+		for n in range(1, self.mip_count):
+			if (self.width >> n) < size:
+				break
+			level = n
+		return level
+
 	@property
 	def image(self):
-		from PIL import Image
+		return self.get_image()
+
+	def get_image(self, flip=False, level=0):
+		"""
+		Decode mip `level` of the texture to a PIL Image, flipped the right
+		way up during decoding if `flip` is set. See decode_image().
+		"""
+		format = self.format
+		if format in CRUNCHED_FORMATS:
+			data = self.decrunch(level)
+			width, height = mip_size(self.width, self.height, level)
+			return decode_image(data, CRUNCHED_FORMATS[format], width, height, flip)
+		return decode_image(self._image_view, format, self.width, self.height, flip, level)
+
+	def thumbnail(self, size, flip=True):
+		"""
+		Return the texture as a PIL Image no larger than `size` pixels,
+		decoded from the smallest mip level it can be shrunk from.
+		"""
+		image = self.get_image(flip, self.mip_level_for(size))
+		if image is not None:
+			image.thumbnail((size, size))
+		return image
+
+	def decrunch(self, level=0):
+		"""
+		Return mip `level` of a crunched texture, going through the crunch
+		cache.
+		"""
 		from decrunch import File as CrunchFile
 
-		if self.format not in IMPLEMENTED_FORMATS:
-			raise NotImplementedError("Unimplemented format %r" % (self.format))
-
-		if self.format in (TextureFormat.DXT1, TextureFormat.DXT1Crunched):
-			codec = "bcn"
-			args = (1, )
-		elif self.format in (TextureFormat.DXT5, TextureFormat.DXT5Crunched):
-			codec = "bcn"
-			args = (3, )
-		elif self.format == TextureFormat.BC7:
-			codec = "bcn"
-			args = (7, )
-		else:
-			codec = "raw"
-			args = (self.format.pixel_format, )
+		cache = self.crunch_cache
+		key = (self._data_key, level)
+		data = cache.get(key)
+		if data is None:
+			data = CrunchFile(self.image_data).decode_level(level)
+			cache.put(key, data, len(data))
+		return data
 
-		mode = "RGB" if self.format.pixel_format in ("RGB", "RGB;16") else "RGBA"
-		size = (self.width, self.height)
+	@property
+	def _data_key(self):
+		# Identifies the image data across reads of the texture: where it
+		# is streamed from, or a digest of it if it is inline
+		if self.stream_data and self.stream_data.asset:
+			return (self.stream_data.path, self.stream_data.offset, self.stream_data.size)
+		if not hasattr(self, "_digest"):
+			from hashlib import sha1
+
+			self._digest = sha1(self.data).digest()
+		return self._digest
+
+	def encode(self, image_format="png", flip=True, thumbnail=None):
+		"""
+		Return the image encoded as `image_format`, shrunk to `thumbnail`
+		pixels if it is set. See encode_image().
+		"""
+		if thumbnail:
+			image = self.thumbnail(thumbnail, flip)
+		else:
+			image = self.get_image(flip)
+		return _save_image(image, image_format)
+
+	def decode_async(self, pool, image_format="png", flip=True, thumbnail=None):
+		"""
+		Decode the texture in `pool` (a concurrent.futures executor),
+		returning a Future of the image encoded as `image_format`.
+		See encode_image().
+		"""
+		level = self.mip_level_for(thumbnail) if thumbnail else 0
+		format = self.format
+		data = self._image_view
+		width, height = self.width, self.height
+		if format in IMPLEMENTED_FORMATS and format not in CRUNCHED_FORMATS:
+			# Only send the mip level which is decoded
+			start, end = mip_range(format, width, height, level)
+			data = memoryview(data)[start:end]
+			width, height = mip_size(width, height, level)
+			level = 0
+		return pool.submit(
+			encode_image, bytes(data), int(format), width, height,
+			image_format, flip, level, thumbnail
+		)
 
-		data = self.image_data
-		if self.format in (TextureFormat.DXT1Crunched, TextureFormat.DXT5Crunched):
-			data = CrunchFile(self.image_data).decode_level(0)
 
-		# Pillow wants bytes, not bytearrays
+def mip_size(width, height, level):
+	"""
+	Return the size of mip `level` of a `width` by `height` texture.
+	"""
+	if not level:
+		return width, height
+	return max(width >> level, 1), max(height >> level, 1)
+
+
+def mip_range(format, width, height, level):
+	"""
+	Return the `(start, end)` of mip `level` in the image data of a
+	`width` by `height` texture in `format`.
+	"""
+	format = TextureFormat(format)
+	if format in BLOCK_SIZES:
+		def level_size(width, height):
+			return ((width + 3) // 4) * ((height + 3) // 4) * BLOCK_SIZES[format]
+	elif format in PIXEL_SIZES:
+		def level_size(width, height):
+			return width * height * PIXEL_SIZES[format]
+	else:
+		raise NotImplementedError("Unknown mip level size of %r" % (format))
+
+	start = 0
+	for n in range(level):
+		start += level_size(*mip_size(width, height, n))
+	return start, start + level_size(*mip_size(width, height, level))
+
+
+def decode_image(data, format, width, height, flip=False, level=0):
+	"""
+	Decode mip `level` of the image `data` of a texture (any buffer),
+	returning a PIL Image (or None if the texture is empty). Textures are
+	stored upside down; if `flip` is set, raw images are flipped back
+	while decoding, and block compressed ones right after.
+	"""
+	from PIL import Image
+
+	format = TextureFormat(format)
+	if format not in IMPLEMENTED_FORMATS:
+		raise NotImplementedError("Unimplemented format %r" % (format))
+
+	if format in (TextureFormat.DXT1, TextureFormat.DXT1Crunched):
+		codec = "bcn"
+		args = (1, )
+	elif format in (TextureFormat.DXT5, TextureFormat.DXT5Crunched):
+		codec = "bcn"
+		args = (3, )
+	elif format == TextureFormat.BC7:
+		codec = "bcn"
+		args = (7, )
+	else:
+		codec = "raw"
+		# A negative row step decodes the rows bottom up
+		args = (format.pixel_format, 0, -1 if flip else 1)
+
+	mode = "RGB" if format.pixel_format in ("RGB", "RGB;16") else "RGBA"
+
+	if not isinstance(data, (bytes, bytearray, memoryview)):
 		data = bytes(data)
 
-		if not data and size == (0, 0):
-			return None
+	if format in CRUNCHED_FORMATS:
+		from decrunch import File as CrunchFile
 
-		return Image.frombytes(mode, size, data, codec, args)
+		data = CrunchFile(data).decode_level(level)
+	elif level:
+		start, end = mip_range(format, width, height, level)
+		data = memoryview(data)[start:end]
+	size = mip_size(width, height, level)
+
+	if not len(data) and size == (0, 0):
+		return None
+
+	image = Image.frombytes(mode, size, data, codec, args)
+	if flip and codec != "raw":
+		image = image.transpose(Image.FLIP_TOP_BOTTOM)
+	return image
+
+
+def encode_image(
+	data, format, width, height, image_format="png", flip=True, level=0, thumbnail=None
+):
+	"""
+	Decode mip `level` of the image `data` of a texture and return it
+	encoded as `image_format` (or None if the texture is empty), shrunk
+	to `thumbnail` pixels if it is set. Textures are stored upside down;
+	they are flipped back if `flip` is set.
+	"""
+	image = decode_image(data, format, width, height, flip, level)
+	if image is not None and thumbnail:
+		image.thumbnail((thumbnail, thumbnail))
+	return _save_image(image, image_format)
+
+
+def _save_image(image, image_format):
+	from io import BytesIO
+
+	if image is None:
+		return None
+	ret = BytesIO()
+	image.save(ret, format=image_format)
+	return ret.getvalue()
+
+
+def decode_many(textures, workers=None, image_format="png", flip=True, thumbnail=None):
+	"""
+	Decode `textures` across a pool of `workers` processes, yielding
+	`(texture, future)` tuples in order, where each future is that of the
+	texture encoded as `image_format` (see Texture2D.decode_async()).
+	Only the raw image data of a few textures per worker is in flight at
+	any time.
+	"""
+	import os
+	from collections import deque
+	from concurrent.futures import ProcessPoolExecutor
+
+	if workers is None:
+		workers = os.cpu_count() or 1
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		limit = workers * 2
+		pending = deque()
+		for texture in textures:
+			future = texture.decode_async(pool, image_format, flip, thumbnail)
+			pending.append((texture, future))
+			if len(pending) >= limit:
+				yield pending.popleft()
+		while pending:
+			yield pending.popleft()
 
 
 class StreamingInfo(Object):
@@ -197,8 +436,11 @@ class StreamingInfo(Object):
 	path = field("path")
 
 	def get_data(self):
+		return bytes(self._get_view())
+
+	def _get_view(self):
+		# A view of the data, without copying it from in-memory assets
 		if not self.asset:
 			logging.warning("No data available for StreamingInfo")
 			return b""
-		self.asset._buf.seek(self.asset._buf_ofs + self.offset)
-		return self.asset._buf.read(self.size)
+		return self.asset._buf.read_at(self.asset._buf_ofs + self.offset, self.size)
@@ -1,45 +1,146 @@
 import os
-from urllib.parse import urlparse
 
 from .asset import Asset
-from .assetbundle import AssetBundle
+from .assetbundle import DEFAULT_BLOCK_CACHE_SIZE, AssetBundle, BlockCache
 from .exceptions import ArchiveNotFound
+from .object import ObjectCache
+from .type import TypeTreeRegistry
+
+
+class ArchiveIndex:
+	"""
+	An index of the archives in a set of directories, mapping their
+	"cab-<basename>" names to their paths. Each directory is listed once,
+	and again only when its mtime changes.
+	"""
+	def __init__(self):
+		self.roots = []
+		self.entries = {}
+		self._dirs = {}
+		self._mtimes = {}
+
+	def __repr__(self):
+		return "<%s %r>" % (self.__class__.__name__, self.roots)
+
+	def add_root(self, path):
+		path = os.path.abspath(path)
+		if path not in self._dirs:
+			self.roots.append(path)
+			self._dirs[path] = {}
+			self._mtimes[path] = None
+
+	def refresh(self):
+		changed = False
+		for root in self.roots:
+			try:
+				mtime = os.stat(root).st_mtime
+			except OSError:
+				mtime = None
+			if mtime == self._mtimes[root]:
+				continue
+			self._mtimes[root] = mtime
+			self._dirs[root] = self._scan(root) if mtime is not None else {}
+			changed = True
+
+		if changed:
+			# Earlier roots take precedence
+			self.entries = {}
+			for root in reversed(self.roots):
+				self.entries.update(self._dirs[root])
+
+	def _scan(self, root):
+		ret = {}
+		with os.scandir(root) as it:
+			for entry in it:
+				if entry.is_file():
+					basename, ext = os.path.splitext(entry.name)
+					key = "cab-" + basename.lower()
+					# Prefer bundles over their .manifest and such
+					if not ext or key not in ret:
+						ret[key] = entry.path
+		return ret
+
+	def find(self, name):
+		"""
+		Return the path of the archive called `name`, or None.
+		"""
+		self.refresh()
+		return self.entries.get(name.lower())
 
 
 class UnityEnvironment:
-	def __init__(self, base_path=""):
+	def __init__(
+		self, base_path="", use_mmap=False, block_cache_size=DEFAULT_BLOCK_CACHE_SIZE,
+		decompress_workers=0, object_cache_size=0, catalog=None, search_paths=()
+	):
 		self.bundles = {}
+		self._bundle_paths = {}
 		self.assets = {}
 		self.base_path = base_path
+		self.use_mmap = use_mmap
+		self.block_cache = BlockCache(block_cache_size)
+		self.decompress_workers = decompress_workers
+		# Decoded objects are only cached if a size is given
+		self.object_cache = ObjectCache(object_cache_size) if object_cache_size else None
+		self.type_registry = TypeTreeRegistry()
+		# A Catalog (or the path of one) recording the contents of loaded files
+		if isinstance(catalog, str):
+			from .catalog import Catalog
+			catalog = Catalog(catalog)
+		self.catalog = catalog
+		# Archives are looked for in search_paths, then next to loaded bundles
+		self.archive_index = ArchiveIndex()
+		for path in search_paths:
+			self.archive_index.add_root(path)
 		self.files = []
 
 	def __del__(self):
+		self.close()
+
+	def close(self):
+		"""
+		Close the bundles and asset files loaded in the environment, along
+		with the files it opened.
+		"""
+		for bundle in self._bundle_paths.values():
+			bundle.close()
+		for asset in self.assets.values():
+			asset.close()
 		for f in self.files:
 			f.close()
+		self.files = []
 
 	def __repr__(self):
 		return "%s(base_path=%r)" % (self.__class__.__name__, self.base_path)
 
 	def load(self, file):
-		for bundle in self.bundles.values():
-			if os.path.abspath(file.name) == os.path.abspath(bundle.path):
-				return bundle
+		path = os.path.abspath(file.name)
+		if path in self._bundle_paths:
+			return self._bundle_paths[path]
 		ret = AssetBundle(self)
 		ret.load(file)
+		self.archive_index.add_root(os.path.dirname(path))
+		self._bundle_paths[path] = ret
 		self.bundles[ret.name.lower()] = ret
 		for asset in ret.assets:
 			self.assets[asset.name.lower()] = asset
+		if self.catalog is not None:
+			self.catalog.add_bundle(ret)
 		return ret
 
 	def discover(self, name):
-		for bundle in list(self.bundles.values()):
-			dirname = os.path.dirname(os.path.abspath(bundle.path))
-			for filename in os.listdir(dirname):
-				basename = os.path.splitext(os.path.basename(filename))[0]
-				if name.lower() == "cab-" + basename.lower():
-					f = open(os.path.join(dirname, filename), "rb")
-					self.files.append(f)
-					self.load(f)
+		"""
+		Load the archive called `name` from the archive index, returning
+		its bundle (or None if there is no such archive).
+		"""
+		path = self.archive_index.find(name)
+		if path is None:
+			return None
+		if path in self._bundle_paths:
+			return self._bundle_paths[path]
+		f = open(path, "rb")
+		self.files.append(f)
+		return self.load(f)
 
 	def get_asset_by_filename(self, name):
 		if name not in self.assets:
@@ -47,10 +148,12 @@ class UnityEnvironment:
 			if os.path.exists(path):
 				f = open(path, "rb")
 				self.files.append(f)
-				self.assets[name] = Asset.from_file(f)
+				self.assets[name] = Asset.from_file(f, environment=self, use_mmap=self.use_mmap)
+				if self.catalog is not None:
+					self.catalog.add_asset(self.assets[name])
 			else:
+				# load() registers the assets of the archive it finds
 				self.discover(name)
-				self.populate_assets()
 				if name not in self.assets:
 					raise KeyError("No such asset: %r" % (name))
 		return self.assets[name]
@@ -66,6 +169,8 @@ class UnityEnvironment:
 		if not url:
 			return None
 
+		from urllib.parse import urlparse
+
 		u = urlparse(url)
 		if u.scheme == "archive":
 			archive, name = os.path.split(u.path.lstrip("/").lower())
@@ -85,3 +190,66 @@ class UnityEnvironment:
 			if asset.name.lower() == name:
 				return asset
 		raise KeyError("No such asset: %r" % (name))
+
+	def find(self, pattern, match="exact"):
+		"""
+		Return the ObjectInfos of the objects of all the loaded assets whose
+		name matches `pattern`. See Asset.find_by_name() for `match`.
+		"""
+		ret = []
+		seen = set()
+		for asset in self.assets.values():
+			if id(asset) in seen or asset.is_resource:
+				continue
+			seen.add(id(asset))
+			ret += asset.find_by_name(pattern, match=match)
+		return ret
+
+	def locate(self, name=None, class_id=None, path_id=None):
+		"""
+		Return the CatalogEntry of every object in the catalog matching the
+		given m_Name, class id and path_id, without loading any file.
+		Looking up a name first records the names of the loaded assets the
+		catalog has none for.
+		"""
+		if self.catalog is None:
+			raise ValueError("No catalog in %r" % (self))
+		if name is not None:
+			seen = set()
+			for asset in self.assets.values():
+				if id(asset) in seen or asset.is_resource:
+					continue
+				seen.add(id(asset))
+				path = asset.bundle.path if asset.bundle is not None else asset.name
+				self.catalog.add_names(path, asset)
+		return self.catalog.find(name=name, class_id=class_id, path_id=path_id)
+
+	def get_object(self, entry):
+		"""
+		Return the ObjectInfo of the object a CatalogEntry refers to,
+		loading only the file it is in. The metadata of the asset the
+		object is in is parsed in full, as its type trees are needed to
+		read the object.
+		"""
+		path = os.path.abspath(entry.path)
+		if entry.signature is None:
+			for asset in self.assets.values():
+				if asset.bundle is None and os.path.abspath(asset.name) == path:
+					break
+			else:
+				f = open(path, "rb")
+				self.files.append(f)
+				asset = Asset.from_file(f, environment=self, use_mmap=self.use_mmap)
+				self.assets[os.path.basename(path).lower()] = asset
+		else:
+			bundle = self._bundle_paths.get(path)
+			if bundle is None:
+				f = open(path, "rb")
+				self.files.append(f)
+				bundle = self.load(f)
+			for asset in bundle.assets:
+				if asset.name == entry.asset:
+					break
+			else:
+				raise KeyError("No such asset: %r" % (entry.asset))
+		return asset.objects[entry.path_id]
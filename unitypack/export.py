@@ -1,197 +1,602 @@
-from io import BytesIO
+import struct
+from io import BytesIO, StringIO
 
-from .utils import BinaryReader
 
+# Vertex formats as numpy dtypes, by the version of Unity they were
+# serialized with: VertexChannelFormat before 2017, VertexFormat after
+VERTEX_FORMATS_LEGACY = ["<f4", "<f2", "u1", "u1", "<u4"]
+VERTEX_FORMATS_2017 = [
+	"<f4", "<f2", "u1", "u1", "i1", "<u2", "<i2", "u1", "i1", "<u2", "<i2", "<u4", "<i4",
+]
+VERTEX_FORMATS = ["<f4", "<f2", "u1", "i1", "<u2", "<i2", "u1", "i1", "<u2", "<i2", "<u4", "<i4"]
 
-class OBJVector2:
-	def __init__(self, x=0, y=0):
-		self.x = x
-		self.y = y
+# glTF componentTypes of numpy dtypes, and bufferView targets
+GLTF_COMPONENT_TYPES = {"i1": 5120, "u1": 5121, "i2": 5122, "u2": 5123, "u4": 5125, "f4": 5126}
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
 
-	def read(self, buf):
-		self.x = buf.read_float()
-		self.y = buf.read_float()
-		return self
+# The attribute of each vertex channel, by the number of channels
+CHANNELS = {
+	6: ["vertices", "normals", "colors", "uv1", "uv2", "tangents"],
+	8: ["vertices", "normals", "colors", "uv1", "uv2", "uv3", "uv4", "tangents"],
+	14: [
+		"vertices", "normals", "tangents", "colors", "uv1", "uv2", "uv3", "uv4",
+		"uv5", "uv6", "uv7", "uv8", "blend_weights", "blend_indices",
+	],
+}
 
-	def __str__(self):
-		return "%s %s" % (self.x, 1 - self.y)
+# GfxPrimitiveType
+TOPOLOGY_TRIANGLES = 0
+TOPOLOGY_TRIANGLE_STRIP = 1
+TOPOLOGY_QUADS = 2
+TOPOLOGY_LINES = 3
+TOPOLOGY_LINE_STRIP = 4
+TOPOLOGY_POINTS = 5
 
 
-class OBJVector3(OBJVector2):
-	def __init__(self, x=0, y=0, z=0):
-		super().__init__(x, y)
-		self.z = z
+def _as_float(numpy, array):
+	# Attributes in integer formats are normalized, to [0, 1] if unsigned
+	# and to [-1, 1] if signed
+	if array.dtype.kind == "f":
+		return array.astype("<f4", copy=False)
+	return numpy.maximum(array / numpy.iinfo(array.dtype).max, -1).astype("<f4")
 
-	def read(self, buf):
-		super().read(buf)
-		self.z = buf.read_float()
-		return self
 
-	def __str__(self):
-		return "%s %s %s" % (-self.x, self.y, self.z)
+def _columns(numpy, array, count):
+	# The first `count` columns of an attribute, or an empty array if it
+	# has fewer
+	if array.ndim != 2 or array.shape[1] < count:
+		return numpy.zeros((0, count), array.dtype)
+	return array[:, :count]
 
 
-class OBJVector4(OBJVector3):
-	def __init__(self, x=0, y=0, z=0, w=0):
-		super().__init__(x, y, z)
-		self.w = w
+def _major_version(unity_version):
+	try:
+		return int(unity_version.split(".")[0])
+	except (AttributeError, ValueError):
+		return None
 
-	def read(self, buf):
-		super().read(buf)
-		self.w = buf.read_float()
-		return self
 
-	def read_color(self, buf):
-		self.x = buf.read_ubyte()
-		self.y = buf.read_ubyte()
-		self.z = buf.read_ubyte()
-		self.w = buf.read_ubyte()
-		return self
-
-	def __str__(self):
-		return "%s %s %s %s" % (self.x, self.y, self.z, self.w)
+class MeshData:
+	"""
+	The vertices and indices of a Mesh, as numpy arrays.
 
+	Each vertex attribute (`vertices`, `normals`, `colors`, `uv1` to
+	`uv8`, `tangents`...) is an array of shape (vertex_count, dimension),
+	empty if the mesh doesn't have it. Floats are decoded to float32;
+	other formats are left as their integer values.
+	`indices` has the index array of each submesh, and `triangles` its
+	triangles as an array of shape (count, 3).
+	"""
+	def __init__(self, mesh, unity_version=None):
+		import numpy
 
-class MeshData:
-	def __init__(self, mesh):
+		self.numpy = numpy
 		self.mesh = mesh
+		self.unity_version = unity_version
 		self.indices = []
 		self.triangles = []
-		self.vertices = []
-		self.normals = []
-		self.colors = []
-		self.uv1 = []
-		self.uv2 = []
-		self.uv3 = []
-		self.uv4 = []
-		self.tangents = []
+		self.vertices = numpy.zeros((0, 3), "<f4")
+		self.normals = numpy.zeros((0, 3), "<f4")
+		self.colors = numpy.zeros((0, 4), "u1")
+		self.uv1 = numpy.zeros((0, 2), "<f4")
+		self.uv2 = numpy.zeros((0, 2), "<f4")
+		self.uv3 = numpy.zeros((0, 2), "<f4")
+		self.uv4 = numpy.zeros((0, 2), "<f4")
+		self.tangents = numpy.zeros((0, 4), "<f4")
+		self.blend_weights = numpy.zeros((0, 4), "<f4")
+		self.blend_indices = numpy.zeros((0, 4), "<u4")
 		self.extract_indices()
 		self.extract_vertices()
+		if mesh.mesh_compression:
+			self.extract_compressed()
+
+	@property
+	def index_dtype(self):
+		obj = self.mesh._obj
+		if "m_IndexFormat" in obj:
+			return "<u4" if obj["m_IndexFormat"] == 1 else "<u2"
+		if "m_Use16BitIndices" in obj:
+			return "<u2" if obj["m_Use16BitIndices"] else "<u4"
+		return "<u2"
 
 	def extract_indices(self):
+		numpy = self.numpy
+		dtype = numpy.dtype(self.index_dtype)
+		triangles = None
+		if self.mesh.mesh_compression:
+			triangles = self.mesh.compressed_mesh["m_Triangles"]
+			if not triangles["m_NumItems"]:
+				triangles = None
+		if triangles is not None:
+			# The indices of compressed meshes are packed instead, but
+			# the submeshes still count bytes of the original index buffer
+			index_buffer = unpack_ints(numpy, triangles)
+		else:
+			index_buffer = numpy.frombuffer(self.mesh.index_buffer, "u1")
+
 		for sub in self.mesh.submeshes:
-			sub_indices = []
-			sub_triangles = []
-			buf = BinaryReader(BytesIO(self.mesh.index_buffer))
-			buf.seek(sub.first_byte)
-			for i in range(0, sub.index_count):
-				sub_indices.append(buf.read_uint16())
-			if not sub.topology:
-				sub_triangles.extend(sub_indices)
+			if triangles is not None:
+				first = sub.first_byte // dtype.itemsize
+				sub_indices = index_buffer[first:first + sub.index_count].astype("<u4")
 			else:
-				raise NotImplementedError("(%s) topologies are not supported" % (self.mesh.name))
-
+				sub_indices = numpy.frombuffer(
+					index_buffer, dtype, count=sub.index_count, offset=sub.first_byte
+				).astype("<u4")
+			if sub.base_vertex:
+				sub_indices += sub.base_vertex
 			self.indices.append(sub_indices)
-			self.triangles.append(sub_triangles)
+			self.triangles.append(self.get_triangles(sub_indices, sub.topology))
+
+	def get_triangles(self, indices, topology):
+		"""
+		Return the triangles made by `indices` in the `topology` of a
+		submesh, as an array of shape (count, 3).
+		"""
+		numpy = self.numpy
+		if topology == TOPOLOGY_TRIANGLES:
+			count = len(indices) // 3
+			return indices[:count * 3].reshape(count, 3)
+
+		if topology == TOPOLOGY_TRIANGLE_STRIP:
+			if len(indices) < 3:
+				return numpy.zeros((0, 3), indices.dtype)
+			a, b, c = indices[:-2], indices[1:-1], indices[2:]
+			# Every other triangle of a strip is wound the other way
+			odd = numpy.arange(len(a)) % 2 == 1
+			triangles = numpy.stack([numpy.where(odd, b, a), numpy.where(odd, a, b), c], axis=1)
+			degenerate = (a == b) | (b == c) | (a == c)
+			return triangles[~degenerate]
+
+		if topology == TOPOLOGY_QUADS:
+			quads = indices[:len(indices) // 4 * 4].reshape(-1, 4)
+			triangles = numpy.empty((len(quads), 2, 3), indices.dtype)
+			triangles[:, 0] = quads[:, [0, 1, 2]]
+			triangles[:, 1] = quads[:, [0, 2, 3]]
+			return triangles.reshape(-1, 3)
+
+		if topology in (TOPOLOGY_LINES, TOPOLOGY_LINE_STRIP, TOPOLOGY_POINTS):
+			return numpy.zeros((0, 3), indices.dtype)
+
+		raise NotImplementedError("(%s) topology %r is not supported" % (self.mesh.name, topology))
+
+	def get_vertex_formats(self, channels):
+		"""
+		Return the dtypes of the vertex formats `channels` refer to. Without
+		a Unity version, the table is worked out from the layout of the
+		vertex data where that is unambiguous.
+		"""
+		version = _major_version(self.unity_version)
+		if version is not None:
+			if version < 2017:
+				formats = VERTEX_FORMATS_LEGACY
+			elif version < 2019:
+				formats = VERTEX_FORMATS_2017
+			else:
+				formats = VERTEX_FORMATS
+		else:
+			formats = self.guess_vertex_formats(channels)
+
+		for ch in channels:
+			if ch["dimension"] & 0xf and ch["format"] >= len(formats):
+				raise NotImplementedError("(%s) unknown vertex format %r" % (self.mesh.name, ch["format"]))
+		return formats
+
+	def guess_vertex_formats(self, channels):
+		used = {ch["format"] for ch in channels if ch["dimension"] & 0xf}
+		if len(channels) == 6 or self.mesh.vertex_data._obj.get("m_Streams"):
+			# Unity 4
+			return VERTEX_FORMATS_LEGACY
+		if len(channels) == 8:
+			# Unity 5 or 2017: the tables agree up to UNorm8/Byte
+			if max(used, default=0) < 4:
+				return VERTEX_FORMATS_LEGACY
+			if max(used) >= len(VERTEX_FORMATS_LEGACY):
+				return VERTEX_FORMATS_2017
+		elif len(channels) == 14:
+			# Unity 2018 or 2019 and up: the tables agree up to UNorm8/Color
+			if max(used, default=0) < 3:
+				return VERTEX_FORMATS
+		raise NotImplementedError(
+			"(%s) the vertex formats depend on the Unity version, which is unknown" % (self.mesh.name)
+		)
+
+	def get_streams(self, channels, vertex_count, formats):
+		"""
+		Return the `(offset, stride)` of each stream of the vertex data.
+		"""
+		streams = self.mesh.vertex_data._obj.get("m_Streams")
+		if streams:
+			# Unity 4 lists its streams
+			return [(s["offset"], s["stride"]) for s in streams]
+
+		strides = {}
+		for ch in channels:
+			dimension = ch["dimension"] & 0xf
+			if dimension:
+				size = self.numpy.dtype(formats[ch["format"]]).itemsize
+				end = ch["offset"] + size * dimension
+				strides[ch["stream"]] = max(strides.get(ch["stream"], 0), end)
+
+		ret = []
+		offset = 0
+		for i in range(max(strides) + 1 if strides else 0):
+			stride = strides.get(i, 0)
+			ret.append((offset, stride))
+			offset += stride * vertex_count
+			# Streams are aligned to 16 bytes
+			offset = (offset + 15) & ~15
+		return ret
 
 	def extract_vertices(self):
-		# unity 5+ has 8 channels (6 otherwise)
-		v5_channel_count = 8
-		buf = BinaryReader(BytesIO(self.mesh.vertex_data.data))
-		channels = self.mesh.vertex_data.channels
-		# actual streams attribute 'm_Streams' may only exist in unity 4,
-		# use of channel data alone seems to be sufficient
-		stream_count = self.get_num_streams(channels)
-		channel_count = len(channels)
-
-		for s in range(0, stream_count):
-			for i in range(0, self.mesh.vertex_data.vertex_count):
-				for j in range(0, channel_count):
-					ch = None
-					if channel_count > 0:
-						ch = channels[j]
-						# format == 1, use half-floats (16 bit)
-						if ch["format"] == 1:
-							raise NotImplementedError("(%r) 16 bit floats are not supported" % (self.mesh))
-					# read the appropriate vertex value into the correct list
-					if ch and ch["dimension"] > 0 and ch["stream"] == s:
-						if j == 0:
-							self.vertices.append(OBJVector3().read(buf))
-						elif j == 1:
-							self.normals.append(OBJVector3().read(buf))
-						elif j == 2:
-							self.colors.append(OBJVector4().read_color(buf))
-						elif j == 3:
-							self.uv1.append(OBJVector2().read(buf))
-						elif j == 4:
-							self.uv2.append(OBJVector2().read(buf))
-						elif j == 5:
-							if channel_count == v5_channel_count:
-								self.uv3.append(OBJVector2().read(buf))
-							else:
-								self.tangents.append(OBJVector4().read(buf))
-						elif j == 6:  # for unity 5+
-							self.uv4.append(OBJVector2().read(buf))
-						elif j == 7:  # for unity 5+
-							self.tangents.append(OBJVector4().read(buf))
-			# TODO investigate possible alignment here, after each stream
-
-	def get_num_streams(self, channels):
-		streams = []
-		# scan the channel's stream value for distinct entries
-		for c in channels:
-			if c["stream"] not in streams:
-				streams.append(c["stream"])
-
-		return len(streams)
+		numpy = self.numpy
+		vertex_data = self.mesh.vertex_data
+		data = vertex_data.data
+		channels = vertex_data.channels
+		vertex_count = vertex_data.vertex_count
+		if not vertex_count:
+			# Compressed meshes keep their vertices elsewhere
+			return
+		if channels is None or len(channels) not in CHANNELS:
+			raise NotImplementedError("(%s) unknown vertex channel layout" % (self.mesh.name))
+
+		names = CHANNELS[len(channels)]
+		formats = self.get_vertex_formats(channels)
+		streams = self.get_streams(channels, vertex_count, formats)
+		for name, ch in zip(names, channels):
+			dimension = ch["dimension"] & 0xf
+			if not dimension:
+				continue
+			dtype = numpy.dtype(formats[ch["format"]])
+			stream_offset, stride = streams[ch["stream"]]
+			# A strided view of the channel in its stream
+			view = numpy.ndarray(
+				(vertex_count, dimension), dtype, buffer=data,
+				offset=stream_offset + ch["offset"], strides=(stride, dtype.itemsize),
+			)
+			if dtype.kind == "f":
+				values = view.astype("<f4")
+			else:
+				values = view.copy()
+			setattr(self, name, values)
+
+	def extract_compressed(self):
+		"""
+		Decode the attributes of m_CompressedMesh, replacing those read
+		from the vertex data.
+		"""
+		numpy = self.numpy
+		compressed = self.mesh.compressed_mesh
+
+		vertices = compressed["m_Vertices"]
+		if vertices["m_NumItems"]:
+			self.vertices = unpack_floats(numpy, vertices).reshape(-1, 3)
+		vertex_count = len(self.vertices)
+
+		uv = compressed["m_UV"]
+		if uv["m_NumItems"]:
+			uv_info = compressed.get("m_UVInfo", 0)
+			if uv_info:
+				# 4 bits per UV channel: whether it exists, and its dimension
+				start = 0
+				for i in range(8):
+					bits = (uv_info >> (i * 4)) & 0xf
+					if bits & 4:
+						dimension = 1 + (bits & 3)
+						count = dimension * vertex_count
+						values = unpack_floats(numpy, uv, start, count).reshape(-1, dimension)
+						setattr(self, "uv%i" % (i + 1), values)
+						start += count
+			else:
+				self.uv1 = unpack_floats(numpy, uv, 0, vertex_count * 2).reshape(-1, 2)
+				if uv["m_NumItems"] >= vertex_count * 4:
+					self.uv2 = unpack_floats(numpy, uv, vertex_count * 2, vertex_count * 2).reshape(-1, 2)
+
+		normals = compressed["m_Normals"]
+		if normals["m_NumItems"]:
+			signs = unpack_ints(numpy, compressed["m_NormalSigns"])
+			self.normals = self._unpack_directions(unpack_floats(numpy, normals), signs)
+
+		tangents = compressed["m_Tangents"]
+		if tangents["m_NumItems"]:
+			signs = unpack_ints(numpy, compressed["m_TangentSigns"]).reshape(-1, 2)
+			directions = self._unpack_directions(unpack_floats(numpy, tangents), signs[:, 0])
+			w = numpy.where(signs[:, 1] > 0, 1, -1).astype("<f4")
+			self.tangents = numpy.column_stack([directions, w[:len(directions)]])
+
+		float_colors = compressed.get("m_FloatColors")
+		colors = compressed.get("m_Colors")
+		if float_colors and float_colors["m_NumItems"]:
+			self.colors = unpack_floats(numpy, float_colors).reshape(-1, 4)
+		elif colors and colors["m_NumItems"]:
+			# Before Unity 5, each item packs the 4 bytes of a color
+			colors = dict(colors, m_NumItems=colors["m_NumItems"] * 4, m_BitSize=colors["m_BitSize"] // 4)
+			self.colors = unpack_ints(numpy, colors).reshape(-1, 4).astype("u1")
+
+		weights = compressed["m_Weights"]
+		if weights["m_NumItems"]:
+			self.blend_weights, self.blend_indices = self._unpack_skin(
+				unpack_ints(numpy, weights), unpack_ints(numpy, compressed["m_BoneIndices"])
+			)
+
+	def _unpack_directions(self, xy, signs):
+		# Unit vectors are packed as their x and y, and the sign of z
+		numpy = self.numpy
+		xy = xy.reshape(-1, 2)
+		x, y = xy[:, 0], xy[:, 1]
+		zsqr = 1 - x * x - y * y
+		ret = numpy.column_stack([x, y, numpy.sqrt(numpy.maximum(zsqr, 0))])
+		# Vectors which don't fit the unit sphere are normalized with z = 0
+		outside = zsqr < 0
+		if outside.any():
+			flat = ret[outside]
+			ret[outside] = flat / numpy.linalg.norm(flat, axis=1, keepdims=True)
+		ret[:, 2] = numpy.where(signs[:len(ret)] == 0, -ret[:, 2], ret[:, 2])
+		return ret.astype("<f4")
+
+	def _unpack_skin(self, weights, bone_indices):
+		# Up to 4 weights (out of 31) per vertex. The weights of a vertex
+		# end when they add up to 31; the fourth one is left out and is
+		# whatever the first three leave.
+		vertex_weights = []
+		vertex_indices = []
+		current_weights = []
+		current_indices = []
+		bone_indices = iter(bone_indices.tolist())
+		total = 0
+		for weight in weights.tolist():
+			current_weights.append(weight / 31)
+			current_indices.append(next(bone_indices))
+			total += weight
+			if total >= 31 or len(current_weights) == 3:
+				if total < 31:
+					current_weights.append((31 - total) / 31)
+					current_indices.append(next(bone_indices))
+				padding = 4 - len(current_weights)
+				vertex_weights.append(current_weights + [0] * padding)
+				vertex_indices.append(current_indices + [0] * padding)
+				current_weights = []
+				current_indices = []
+				total = 0
+
+		numpy = self.numpy
+		return (
+			numpy.array(vertex_weights, "<f4").reshape(-1, 4),
+			numpy.array(vertex_indices, "<u4").reshape(-1, 4),
+		)
+
+
+def _unpack_bits(numpy, vector, start, count):
+	# Items are packed least significant bit first, m_BitSize bits each
+	bit_size = vector["m_BitSize"]
+	if count is None:
+		count = vector["m_NumItems"] - start
+	dtype = numpy.dtype("<u4" if bit_size <= 32 else "<u8")
+	if not bit_size or count <= 0:
+		return numpy.zeros(max(count, 0), dtype)
+
+	first_bit = start * bit_size
+	end_bit = first_bit + count * bit_size
+	data = numpy.frombuffer(vector["m_Data"], "u1")[first_bit // 8:(end_bit + 7) // 8]
+	bits = numpy.unpackbits(data, bitorder="little")
+	bits = bits[first_bit % 8:first_bit % 8 + count * bit_size].reshape(count, bit_size)
+	# Add up one bit position at a time, so that only a column of the
+	# bits is widened at once
+	ret = numpy.zeros(count, dtype)
+	for i in range(bit_size):
+		ret |= bits[:, i].astype(dtype) << dtype.type(i)
+	return ret
+
+
+def unpack_ints(numpy, vector, start=0, count=None):
+	"""
+	Unpack `count` items from `start` of a PackedBitVector of integers.
+	"""
+	return _unpack_bits(numpy, vector, start, count).astype("<u4", copy=False)
+
+
+def unpack_floats(numpy, vector, start=0, count=None):
+	"""
+	Unpack `count` items from `start` of a PackedBitVector of floats,
+	quantized to m_BitSize bits over m_Range from m_Start.
+	"""
+	values = _unpack_bits(numpy, vector, start, count)
+	bit_size = vector["m_BitSize"]
+	if bit_size:
+		values = values * (vector["m_Range"] / ((1 << bit_size) - 1))
+	return (values + vector["m_Start"]).astype("<f4")
 
 
 class OBJMesh:
-	def __init__(self, mesh):
-		if mesh.mesh_compression:
-			# TODO handle compressed meshes
-			raise NotImplementedError("(%s) compressed meshes are not supported" % (mesh.name))
-		self.mesh_data = MeshData(mesh)
+	def __init__(self, mesh, unity_version=None):
+		self.mesh_data = MeshData(mesh, unity_version=unity_version)
 		self.mesh = mesh
 
-	@staticmethod
-	def face_str(indices, coords, normals):
-		ret = ["f "]
-		for i in indices[::-1]:
-			ret.append(str(i + 1))
-			if coords or normals:
-				ret.append("/")
-				if coords:
-					ret.append(str(i + 1))
-				if normals:
-					ret.append("/")
-					ret.append(str(i + 1))
-			ret.append(" ")
-		ret.append("\n")
-		return "".join(ret)
-
 	def export(self):
-		ret = []
-		verts_per_face = 3
-		normals = self.mesh_data.normals
-		tex_coords = self.mesh_data.uv1
-		if not tex_coords:
-			tex_coords = self.mesh_data.uv2
-
-		for v in self.mesh_data.vertices:
-			ret.append("v %s\n" % (v))
-		for v in normals:
-			ret.append("vn %s\n" % (v))
-		for v in tex_coords:
-			ret.append("vt %s\n" % (v))
-		ret.append("\n")
+		ret = StringIO()
+		self.write(ret)
+		return ret.getvalue()
+
+	def write(self, f):
+		"""
+		Write the mesh as OBJ to the text file `f`, in chunks.
+		"""
+		numpy = self.mesh_data.numpy
+		mesh_data = self.mesh_data
+		normals = _as_float(numpy, _columns(numpy, mesh_data.normals, 3))
+		tex_coords = _columns(numpy, mesh_data.uv1, 2)
+		if not len(tex_coords):
+			tex_coords = _columns(numpy, mesh_data.uv2, 2)
+		tex_coords = _as_float(numpy, tex_coords)
+
+		# OBJ is right-handed, and its texture coordinates start at the top
+		vertices = mesh_data.vertices[:, :3] * (-1, 1, 1)
+		self.write_rows(f, "v %.9g %.9g %.9g\n", vertices)
+		self.write_rows(f, "vn %.9g %.9g %.9g\n", normals * (-1, 1, 1))
+		self.write_rows(f, "vt %.9g %.9g\n", tex_coords * (1, -1) + (0, 1))
+		f.write("\n")
 
 		# write group name and set smoothing to 1
-		ret.append("g %s\n" % (self.mesh.name))
-		ret.append("s 1\n")
+		f.write("g %s\n" % (self.mesh.name))
+		f.write("s 1\n")
+
+		if len(tex_coords) and len(normals):
+			vertex = "%d/%d/%d "
+		elif len(tex_coords):
+			vertex = "%d/%d "
+		elif len(normals):
+			vertex = "%d//%d "
+		else:
+			vertex = "%d "
+		face = "f " + vertex * 3 + "\n"
+		repeat = vertex.count("%")
 
 		sub_count = len(self.mesh.submeshes)
 		for i in range(0, sub_count):
 			if sub_count == 1:
-				ret.append("usemtl %s\n" % (self.mesh.name))
+				f.write("usemtl %s\n" % (self.mesh.name))
+			else:
+				f.write("usemtl %s_%d\n" % (self.mesh.name, i))
+			# Faces are wound the other way round in OBJ
+			faces = mesh_data.triangles[i][:, ::-1] + 1
+			self.write_rows(f, face, faces.repeat(repeat, axis=1))
+			f.write("\n")
+
+	@staticmethod
+	def write_rows(f, format, rows, chunk_size=4096):
+		"""
+		Write each of `rows` (a 2D array) formatted with `format`, formatting
+		a chunk of rows at a time.
+		"""
+		for start in range(0, len(rows), chunk_size):
+			chunk = rows[start:start + chunk_size]
+			f.write((format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+class GLBMesh:
+	"""
+	Exports a Mesh as binary glTF: one primitive per submesh, sharing the
+	vertex attributes, with the vertex and index buffers written as is.
+	"""
+	def __init__(self, mesh, unity_version=None):
+		self.mesh_data = MeshData(mesh, unity_version=unity_version)
+		self.mesh = mesh
+		# glTF accessors can't be empty
+		if not len(self.mesh_data.vertices) or not any(len(t) for t in self.mesh_data.triangles):
+			raise NotImplementedError("(%s) mesh has no triangles to export" % (mesh.name))
+
+	def export(self):
+		ret = BytesIO()
+		self.write(ret)
+		return ret.getvalue()
+
+	def write(self, f):
+		"""
+		Write the mesh as GLB to the binary file `f`.
+		"""
+		import json
+
+		gltf, buffers = self.build()
+		length = sum(len(b) for b in buffers)
+		gltf["buffers"] = [{"byteLength": length}]
+
+		data = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+		data += b" " * (-len(data) % 4)
+
+		f.write(struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(data) + 8 + length))
+		f.write(struct.pack("<I4s", len(data), b"JSON"))
+		f.write(data)
+		f.write(struct.pack("<I4s", length, b"BIN\0"))
+		for buffer in buffers:
+			f.write(buffer)
+
+	def build(self):
+		"""
+		Return the glTF JSON of the mesh (without its buffer), and the
+		chunks of its binary buffer as memoryviews.
+		"""
+		numpy = self.mesh_data.numpy
+		mesh_data = self.mesh_data
+		buffers = []
+		buffer_views = []
+		accessors = []
+		offset = 0
+
+		def add_accessor(array, type, target, normalized=False, bounds=False):
+			nonlocal offset
+			array = numpy.ascontiguousarray(array)
+			view = {"buffer": 0, "byteOffset": offset, "byteLength": array.nbytes, "target": target}
+			accessor = {
+				"bufferView": len(buffer_views),
+				"componentType": GLTF_COMPONENT_TYPES[array.dtype.str.lstrip("<|")],
+				"count": len(array),
+				"type": type,
+			}
+			if normalized:
+				accessor["normalized"] = True
+			if bounds and len(array):
+				accessor["min"] = array.min(axis=0).tolist()
+				accessor["max"] = array.max(axis=0).tolist()
+			buffers.append(memoryview(array).cast("B"))
+			# Every buffer view starts 4-byte aligned
+			padding = -array.nbytes % 4
+			if padding:
+				buffers.append(bytes(padding))
+			offset += array.nbytes + padding
+			buffer_views.append(view)
+			accessors.append(accessor)
+			return len(accessors) - 1
+
+		# glTF is right-handed, and its texture coordinates start at the top
+		count = len(mesh_data.vertices)
+		attributes = {}
+		attributes["POSITION"] = add_accessor(
+			mesh_data.vertices[:, :3] * numpy.float32((-1, 1, 1)), "VEC3", GLTF_ARRAY_BUFFER, bounds=True
+		)
+		# Normals, tangents and texture coordinates must be floats
+		normals = _columns(numpy, mesh_data.normals, 3)
+		if len(normals) == count:
+			attributes["NORMAL"] = add_accessor(
+				_as_float(numpy, normals) * numpy.float32((-1, 1, 1)), "VEC3", GLTF_ARRAY_BUFFER
+			)
+		tangents = _columns(numpy, mesh_data.tangents, 4)
+		if len(tangents) == count:
+			attributes["TANGENT"] = add_accessor(
+				_as_float(numpy, tangents) * numpy.float32((-1, 1, 1, -1)), "VEC4", GLTF_ARRAY_BUFFER
+			)
+		for i, name in enumerate(("uv1", "uv2")):
+			uv = _columns(numpy, getattr(mesh_data, name), 2)
+			if len(uv) == count:
+				uv = _as_float(numpy, uv) * numpy.float32((1, -1)) + numpy.float32((0, 1))
+				attributes["TEXCOORD_%i" % (i)] = add_accessor(uv, "VEC2", GLTF_ARRAY_BUFFER)
+		colors = mesh_data.colors
+		if len(colors) == count and colors.ndim == 2 and colors.shape[1] in (3, 4):
+			type = "VEC%i" % (colors.shape[1])
+			if colors.dtype.kind == "u" and colors.dtype.itemsize <= 2:
+				attributes["COLOR_0"] = add_accessor(colors, type, GLTF_ARRAY_BUFFER, normalized=True)
 			else:
-				ret.append("usemtl %s_%d\n" % (self.mesh.name, i))
-			face_tri = []
-			for t in self.mesh_data.triangles[i]:
-				face_tri.append(t)
-				if len(face_tri) == verts_per_face:
-					ret.append(self.face_str(face_tri, tex_coords, normals))
-					face_tri = []
-			ret.append("\n")
-
-		return "".join(ret)
+				attributes["COLOR_0"] = add_accessor(_as_float(numpy, colors), type, GLTF_ARRAY_BUFFER)
+
+		primitives = []
+		for triangles in mesh_data.triangles:
+			if not len(triangles):
+				continue
+			# Triangles are wound the other way round in glTF
+			indices = triangles[:, ::-1].ravel()
+			dtype = "<u2" if count <= 0xffff else "<u4"
+			primitives.append({
+				"attributes": attributes,
+				"indices": add_accessor(indices.astype(dtype), "SCALAR", GLTF_ELEMENT_ARRAY_BUFFER),
+				"mode": 4,  # TRIANGLES
+			})
+
+		gltf = {
+			"asset": {"version": "2.0", "generator": "unitypack"},
+			"scene": 0,
+			"scenes": [{"nodes": [0]}],
+			"nodes": [{"mesh": 0, "name": self.mesh.name}],
+			"meshes": [{"name": self.mesh.name, "primitives": primitives}],
+			"accessors": accessors,
+			"bufferViews": buffer_views,
+		}
+		return gltf, buffers
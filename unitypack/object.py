@@ -1,10 +1,13 @@
+import struct
+from array import array
 from collections import OrderedDict
-from io import BytesIO
+from collections.abc import Mapping
 
 from . import engine as UnityEngine
+from .decoder import check_decoded, get_decoder, get_fields, get_projection
 from .resources import UnityClass
 from .type import TypeMetadata, TypeTree
-from .utils import BinaryReader
+from .utils import LRUCache, MemoryReader
 
 
 def load_object(type, obj):
@@ -16,6 +19,19 @@ def load_object(type, obj):
 
 
 class ObjectInfo:
+	# Decode objects with decoders compiled from their TypeTree
+	use_decoders = True
+	# Check the compiled decoders against read_value() (slow)
+	validate_decoders = False
+	# How compiled decoders decode arrays of numbers and fixed-layout
+	# structs: "list", "array" (array.array) or "numpy"
+	array_mode = "list"
+
+	__slots__ = (
+		"asset", "path_id", "data_offset", "size", "type_id", "class_id",
+		"is_destroyed", "unk0", "unk1",
+	)
+
 	def __init__(self, asset):
 		self.asset = asset
 
@@ -27,7 +43,7 @@ class ObjectInfo:
 		if self.type_id > 0:
 			return UnityClass(self.type_id)
 		elif self.type_id not in self.asset.typenames:
-			script = self.read()["m_Script"]
+			script = self.read(lazy=True)["m_Script"]
 			if script:
 				try:
 					typename = script.resolve()["m_ClassName"]
@@ -77,11 +93,76 @@ class ObjectInfo:
 		else:
 			return self.asset.read_id(buf)
 
-	def read(self):
+	@property
+	def object_cache(self):
+		environment = getattr(self.asset, "environment", None)
+		return getattr(environment, "object_cache", None)
+
+	def read(self, lazy=False, fields=None):
+		"""
+		Decode the object. If `lazy` is set, return it over a LazyObject
+		which only decodes the fields that are accessed.
+		If `fields` is set, only decode those fields: names of top-level
+		fields or dotted paths to fields of nested structs, which are then
+		decoded to OrderedDicts of those fields. Missing fields are ignored.
+
+		Full reads go through the environment's object cache, if it has one.
+		Lazy reads use it if the object is already cached.
+		"""
+		cache = self.object_cache
+		if cache is None or fields is not None:
+			return self._read(lazy, fields)
+
+		key = (self.asset, self.path_id)
+		if lazy:
+			# Don't count a miss for objects which are not meant to be cached
+			ret = cache.get(key) if key in cache else None
+			return ret if ret is not None else self._read(lazy)
+
+		ret = cache.get(key)
+		if ret is None:
+			ret = self._read()
+			cache.put(key, ret, self.size)
+		return ret
+
+	def read_name(self):
+		"""
+		Return the m_Name of the object, decoding only that field, or None
+		if it has none or it can't be read.
+		"""
+		try:
+			type_tree = self.type_tree
+			if type_tree is None or not any(child.name == "m_Name" for child in type_tree.children):
+				return None
+			data = self._read(fields=["m_Name"])
+		except (KeyError, ValueError, EOFError, NotImplementedError, struct.error):
+			# No type tree for it, or data the tree doesn't describe
+			return None
+		return getattr(data, "_obj", data).get("m_Name")
+
+	def _read(self, lazy=False, fields=None):
 		buf = self.asset._buf
-		buf.seek(self.asset._buf_ofs + self.data_offset)
-		object_buf = buf.read(self.size)
-		return self.read_value(self.type_tree, BinaryReader(BytesIO(object_buf)))
+		object_buf = buf.read_at(self.asset._buf_ofs + self.data_offset, self.size)
+		type_tree = self.type_tree
+		if not self.use_decoders:
+			return self.read_value(type_tree, MemoryReader(object_buf))
+
+		if fields is not None:
+			decoder = get_projection(type_tree, self.asset.format, fields, self.array_mode)
+			return decoder(object_buf, 0, self)[0]
+
+		if lazy:
+			fields = get_fields(type_tree, self.asset.format, self.array_mode)
+			if fields is not None:
+				fields, finish = fields
+				return finish(LazyObject(self, object_buf, fields), self)
+
+		decoder = get_decoder(type_tree, self.asset.format, self.array_mode)
+		result, pos = decoder(object_buf, 0, self)
+		if self.validate_decoders:
+			expected = self.read_value(type_tree, MemoryReader(object_buf))
+			check_decoded(self, result, expected)
+		return result
 
 	def read_value(self, type, buf):
 		align = False
@@ -182,6 +263,215 @@ class ObjectInfo:
 			return self.asset.get_asset(path)
 
 
+class ObjectTable(Mapping):
+	"""
+	The objects of an asset by path_id, stored as columns (arrays) of their
+	fields. ObjectInfos are created from them when objects are looked up.
+	"""
+	def __init__(self, asset):
+		self.asset = asset
+		self.path_ids = array("q")
+		self.data_offsets = array("q")
+		self.sizes = array("q")
+		self.type_ids = array("i")
+		self.class_ids = array("i")
+		# Only present in some formats
+		self.extra = {}
+		self.index = {}
+
+	def __getitem__(self, path_id):
+		return self.get_info(self.index[path_id])
+
+	def __contains__(self, path_id):
+		return path_id in self.index
+
+	def __iter__(self):
+		return iter(self.path_ids)
+
+	def __len__(self):
+		return len(self.path_ids)
+
+	def get_info(self, i):
+		obj = ObjectInfo(self.asset)
+		obj.path_id = self.path_ids[i]
+		obj.data_offset = self.data_offsets[i]
+		obj.size = self.sizes[i]
+		obj.type_id = self.type_ids[i]
+		obj.class_id = self.class_ids[i]
+		for name, column in self.extra.items():
+			setattr(obj, name, column[i])
+		return obj
+
+	def types(self):
+		"""
+		Return the distinct `(type_id, class_id)` pairs of the objects.
+		"""
+		return list(OrderedDict.fromkeys(zip(self.type_ids, self.class_ids)))
+
+	def add(self, obj):
+		if obj.path_id in self.index:
+			raise ValueError("Duplicate asset object: %r (path_id=%r)" % (obj, obj.path_id))
+		self.index[obj.path_id] = len(self.path_ids)
+		self.path_ids.append(obj.path_id)
+		self.data_offsets.append(obj.data_offset)
+		self.sizes.append(obj.size)
+		self.type_ids.append(obj.type_id)
+		self.class_ids.append(obj.class_id)
+		for name, column in self.extra.items():
+			column.append(getattr(obj, name))
+
+	def load(self, buf, count):
+		"""
+		Read `count` entries of an object table from buf in one go; they
+		have the same layout as what ObjectInfo.load() reads.
+		"""
+		asset = self.asset
+		format = asset.format
+		fields = ["path_id", "data_offset", "size", "type_id"]
+		fmt = "q" if asset.long_object_ids or format >= 14 else "i"
+		fmt += "IIi"
+		if format < 17:
+			fields.append("class_id")
+			fmt += "h"
+		if format <= 10:
+			fields.append("is_destroyed")
+			fmt += "h"
+		if 11 <= format <= 16:
+			fields.append("unk0")
+			fmt += "h"
+		if 15 <= format <= 16:
+			fields.append("unk1")
+			fmt += "b"
+
+		# From format 14, every entry is aligned to 4 bytes
+		pad = 0
+		if format >= 14 and count:
+			buf.align()
+			pad = -struct.calcsize("<" + fmt) % 4
+		record = struct.Struct(buf.endian + fmt + "x" * pad)
+		if count:
+			data = buf.read_view(record.size * count)
+			if len(data) < record.size * count:
+				raise ValueError("Object table runs past the end of the metadata")
+			columns = dict(zip(fields, zip(*record.iter_unpack(data))))
+			# The padding of the last entry is not part of the table
+			buf.seek(buf.tell() - pad)
+		else:
+			columns = dict.fromkeys(fields, ())
+
+		base = asset.data_offset
+		path_ids = columns["path_id"]
+		type_ids = columns["type_id"]
+		if format >= 17:
+			class_ids = [asset.tree.class_ids[type_id] for type_id in type_ids]
+			type_ids = class_ids
+		else:
+			class_ids = columns["class_id"]
+
+		self.index = {path_id: i for i, path_id in enumerate(path_ids)}
+		self.path_ids = array("q", path_ids)
+		self.data_offsets = array("q", [offset + base for offset in columns["data_offset"]])
+		self.sizes = array("q", columns["size"])
+		self.type_ids = array("i", type_ids)
+		self.class_ids = array("i", class_ids)
+		self.extra = {}
+		if "is_destroyed" in columns:
+			self.extra["is_destroyed"] = [bool(x) for x in columns["is_destroyed"]]
+		if "unk0" in columns:
+			self.extra["unk0"] = array("h", columns["unk0"])
+		if "unk1" in columns:
+			self.extra["unk1"] = array("b", columns["unk1"])
+
+		if len(self.index) != len(self.path_ids):
+			for i, path_id in enumerate(self.path_ids):
+				if self.index[path_id] != i:
+					obj = self.get_info(i)
+					raise ValueError("Duplicate asset object: %r (path_id=%r)" % (obj, path_id))
+
+
+class ObjectCache(LRUCache):
+	"""
+	An LRU cache of decoded objects, keyed by `(asset, path_id)`.
+	It is bounded by the serialized size of the objects, which stands in
+	for their (larger) decoded size. Cached objects are shared between
+	readers and must not be modified.
+	"""
+	def invalidate(self, asset=None, path_id=None):
+		"""
+		Drop the object `path_id` of `asset`, all the objects of `asset`
+		if `path_id` is None, or everything if `asset` is None too.
+		"""
+		if asset is None:
+			self.clear()
+		elif path_id is not None:
+			self.remove((asset, path_id))
+		else:
+			self.remove_if(lambda key: key[0] is asset)
+
+
+class LazyObject(Mapping):
+	"""
+	A read-only mapping over the fields of an object, which decodes each
+	field the first time it is accessed. The fields before it are skipped
+	over using their size instead of being decoded.
+	"""
+	def __init__(self, obj, data, fields):
+		self.object_info = obj
+		self.data = data
+		self.fields = fields
+		self._offsets = [0]
+		self._values = {}
+		# Like an OrderedDict, later fields override earlier ones of the same name
+		self._indices = {field.name: i for i, field in enumerate(fields)}
+		self._keys = list(OrderedDict.fromkeys(field.name for field in fields))
+
+	def __repr__(self):
+		return "<%s %r>" % (self.__class__.__name__, self.object_info)
+
+	def __getitem__(self, key):
+		i = self._indices[key]
+		if i not in self._values:
+			field = self.fields[i]
+			value, pos = field.read(self.data, self.offset(i), self.object_info)
+			self._values[i] = value
+			if len(self._offsets) == i + 1:
+				self._offsets.append(pos)
+		return self._values[i]
+
+	def __contains__(self, key):
+		return key in self._indices
+
+	def __iter__(self):
+		return iter(self._keys)
+
+	def __len__(self):
+		return len(self._keys)
+
+	def offset(self, i):
+		"""
+		Return the offset of the i-th field in the object data.
+		"""
+		offsets = self._offsets
+		while len(offsets) <= i:
+			j = len(offsets) - 1
+			offsets.append(self.fields[j].skip(self.data, offsets[j], self.object_info))
+		return offsets[i]
+
+	def view(self, key):
+		"""
+		Return the contents of the byte array field `key` as a memoryview
+		of the object data, without copying them.
+		"""
+		i = self._indices[key]
+		if not self.fields[i].is_byte_array:
+			raise ValueError("%r is not a byte array" % (key))
+		buf = MemoryReader(self.data, offset=self.offset(i))
+		size = buf.read_uint()
+		if buf.tell() + size > buf.size:
+			raise ValueError("%r runs past the end of the object data" % (key))
+		return buf.read_view(size)
+
+
 class ExposedReferenceInfo(ObjectInfo):
 
 	def read_value(self, type, buf):
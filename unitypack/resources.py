@@ -1,18 +1,33 @@
-import json
 import os
+from functools import lru_cache
 
 
 def get_resource(name):
 	return os.path.join(os.path.dirname(__file__), name)
 
 
-with open(get_resource("strings.dat"), "rb") as f:
-	STRINGS_DAT = f.read()
+@lru_cache()
+def get_strings_dat():
+	with open(get_resource("strings.dat"), "rb") as f:
+		return f.read()
 
 
-with open(get_resource("classes.json"), "r") as f:
-	UNITY_CLASSES = json.load(f)
+@lru_cache()
+def get_unity_classes():
+	import json
+
+	with open(get_resource("classes.json"), "r") as f:
+		return json.load(f)
+
+
+def __getattr__(name):
+	# The resources used to be loaded on import
+	if name == "STRINGS_DAT":
+		return get_strings_dat()
+	elif name == "UNITY_CLASSES":
+		return get_unity_classes()
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 def UnityClass(i):
-	return UNITY_CLASSES.get(str(i), "<Unknown #%i>" % (i))
+	return get_unity_classes().get(str(i), "<Unknown #%i>" % (i))
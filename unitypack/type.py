@@ -1,15 +1,24 @@
-from io import BytesIO
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from functools import lru_cache
 
 from .enums import RuntimePlatform
-from .resources import STRINGS_DAT, get_resource
-from .utils import BinaryReader
+from .resources import get_resource, get_strings_dat
+from .utils import MemoryReader
 
 
 class TypeTree:
 	NULL = "(null)"
 
+	__slots__ = (
+		"_children", "version", "is_array", "size", "index", "flags", "type", "name",
+		"format", "buffer_bytes", "data", "_table", "_node", "_decoders",
+	)
+
 	def __init__(self, format):
-		self.children = []
+		self._children = []
 		self.version = 0
 		self.is_array = False
 		self.size = 0
@@ -18,12 +27,25 @@ class TypeTree:
 		self.type = self.NULL
 		self.name = self.NULL
 		self.format = format
+		self._table = None
 
 	def __repr__(self):
 		return "<%s %s (size=%r, index=%r, is_array=%r, flags=%r)>" % (
 			self.type, self.name, self.size, self.index, self.is_array, self.flags
 		)
 
+	@property
+	def children(self):
+		if self._children is None:
+			# Nodes loaded from a blob create their children on first access
+			table = self._table
+			self._children = [table.node(i) for i in table.children(self._node)]
+		return self._children
+
+	@children.setter
+	def children(self, value):
+		self._children = value
+
 	@property
 	def post_align(self):
 		return bool(self.flags & 0x4000)
@@ -34,9 +56,19 @@ class TypeTree:
 		else:
 			self.load_old(buf)
 
+	@staticmethod
+	def skip_blob(buf, format):
+		"""
+		Skip over a tree serialized as a blob in buf, without parsing it.
+		"""
+		num_nodes = buf.read_uint()
+		buffer_bytes = buf.read_uint()
+		node_bytes = 32 if format >= 19 else 24
+		buf.seek(buf.tell() + node_bytes * num_nodes + buffer_bytes)
+
 	def load_old(self, buf):
-		self.type = buf.read_string()
-		self.name = buf.read_string()
+		self.type = _intern(buf.read_string())
+		self.name = _intern(buf.read_string())
 		self.size = buf.read_int()
 		self.index = buf.read_int()
 		self.is_array = bool(buf.read_int())
@@ -53,46 +85,184 @@ class TypeTree:
 		num_nodes = buf.read_uint()
 		self.buffer_bytes = buf.read_uint()
 		node_bytes = 32 if self.format >= 19 else 24
-		node_data = BytesIO(buf.read(node_bytes * num_nodes))
+		node_data = buf.read_view(node_bytes * num_nodes)
 		self.data = buf.read(self.buffer_bytes)
+		if num_nodes:
+			NodeTable(node_data, self.data, self.format).load_node(self, 0)
 
-		parents = [self]
+	def get_string(self, offset):
+		if self._table is not None:
+			return self._table.get_string(offset)
+		return NodeTable(b"", self.data, self.format).get_string(offset)
 
-		buf = BinaryReader(node_data)
 
-		for i in range(num_nodes):
-			version = buf.read_int16()
-			depth = buf.read_ubyte()
+class NodeTable:
+	"""
+	The nodes of a TypeTree blob as a flat table, in the order they are
+	serialized (depth first): parallel arrays of their fields, with the
+	range of each node's descendants. TypeTree nodes are created from it
+	as the tree is walked.
+	"""
+	__slots__ = (
+		"format", "data", "strings", "versions", "is_arrays", "types", "names",
+		"sizes", "indices", "flags", "ends",
+	)
 
-			if depth == 0:
-				curr = self
-			else:
-				while len(parents) > depth:
-					parents.pop()
-				curr = TypeTree(self.format)
-				parents[-1].children.append(curr)
-				parents.append(curr)
-
-			curr.version = version
-			curr.is_array = buf.read_byte()
-			curr.type = self.get_string(buf.read_int())
-			curr.name = self.get_string(buf.read_int())
-			curr.size = buf.read_int()
-			curr.index = buf.read_uint()
-			curr.flags = buf.read_int()
-
-			# consume unused bytes in the node (always zeros?)
-			buf.read(node_bytes - 24)
+	def __init__(self, node_data, data, format):
+		self.format = format
+		self.data = data
+		self.strings = {}
+
+		fmt = "<hBbiiiIi" + ("8x" if format >= 19 else "")
+		columns = list(zip(*struct.iter_unpack(fmt, node_data))) or [()] * 8
+		versions, depths, is_arrays, types, names, sizes, indices, flags = columns
+		self.versions = array("h", versions)
+		self.is_arrays = array("b", is_arrays)
+		self.types = array("i", types)
+		self.names = array("i", names)
+		self.sizes = array("i", sizes)
+		self.indices = array("I", indices)
+		self.flags = array("i", flags)
+
+		# Each node's descendants are the nodes up to ends[node]
+		count = len(depths)
+		ends = array("i", [count]) * count
+		stack = []
+		for i, depth in enumerate(depths):
+			while stack and depths[stack[-1]] >= depth:
+				ends[stack.pop()] = i
+			stack.append(i)
+		self.ends = ends
+
+	def __len__(self):
+		return len(self.ends)
+
+	def children(self, i):
+		ends = self.ends
+		end = ends[i]
+		i += 1
+		while i < end:
+			yield i
+			i = ends[i]
+
+	def node(self, i):
+		tree = TypeTree(self.format)
+		self.load_node(tree, i)
+		return tree
+
+	def load_node(self, tree, i):
+		tree.version = self.versions[i]
+		tree.is_array = self.is_arrays[i]
+		tree.type = self.get_string(self.types[i])
+		tree.name = self.get_string(self.names[i])
+		tree.size = self.sizes[i]
+		tree.index = self.indices[i]
+		tree.flags = self.flags[i]
+		tree._table = self
+		tree._node = i
+		tree._children = None
 
 	def get_string(self, offset):
-		if offset < 0:
-			offset &= 0x7fffffff
-			data = STRINGS_DAT
-		elif offset < self.buffer_bytes:
-			data = self.data
-		else:
-			return self.NULL
-		return data[offset:].partition(b"\0")[0].decode("utf-8")
+		ret = self.strings.get(offset)
+		if ret is None:
+			if offset < 0:
+				ret = _common_string(offset & 0x7fffffff)
+			elif offset < len(self.data):
+				end = self.data.find(b"\0", offset)
+				if end < 0:
+					end = len(self.data)
+				ret = sys.intern(self.data[offset:end].decode("utf-8"))
+			else:
+				ret = TypeTree.NULL
+			self.strings[offset] = ret
+		return ret
+
+
+def _intern(s):
+	# read_string() returns bytes for strings it can't decode
+	return sys.intern(s) if isinstance(s, str) else s
+
+
+@lru_cache(maxsize=None)
+def _common_string(offset):
+	data = get_strings_dat()
+	end = data.find(b"\0", offset)
+	if end < 0:
+		end = len(data)
+	return sys.intern(data[offset:end].decode("utf-8"))
+
+
+class LazyTypeTrees(Mapping):
+	"""
+	A mapping of class ids to TypeTrees serialized as blobs in data, which
+	only parses each tree the first time it is looked up.
+	"""
+	def __init__(self, data, format):
+		self.data = data
+		self.format = format
+		self.offsets = {}
+		self._trees = {}
+
+	def __getitem__(self, class_id):
+		tree = self._trees.get(class_id)
+		if tree is None:
+			tree = TypeTree(self.format)
+			tree.load(MemoryReader(self.data, offset=self.offsets[class_id]))
+			tree = self._trees.setdefault(class_id, tree)
+		return tree
+
+	def __contains__(self, class_id):
+		return class_id in self.offsets
+
+	def __iter__(self):
+		return iter(self.offsets)
+
+	def __len__(self):
+		return len(self.offsets)
+
+
+class TypeTreeRegistry:
+	"""
+	Interns TypeTrees by `(class_id, hash, format)`, so that identical trees
+	embedded in several assets are only parsed once, and share their
+	compiled decoders.
+	"""
+	def __init__(self):
+		self.trees = {}
+		self.hits = 0
+		self.misses = 0
+
+	def __repr__(self):
+		return "<%s: %i trees, hits=%i, misses=%i>" % (
+			self.__class__.__name__, len(self.trees), self.hits, self.misses
+		)
+
+	def __len__(self):
+		return len(self.trees)
+
+	def load(self, buf, class_id, hash, format):
+		"""
+		Return the tree for `class_id` and `hash` serialized as a blob in
+		buf, skipping over the blob if the tree is already known.
+		"""
+		if not any(hash):
+			# Trees without a hash can't be told apart
+			tree = TypeTree(format)
+			tree.load(buf)
+			return tree
+
+		# Script types are numbered per file; their hash identifies them
+		key = (max(class_id, -1), hash, format)
+		tree = self.trees.get(key)
+		if tree is not None:
+			self.hits += 1
+			TypeTree.skip_blob(buf, format)
+			return tree
+
+		self.misses += 1
+		tree = TypeTree(format)
+		tree.load(buf)
+		return self.trees.setdefault(key, tree)
 
 
 class TypeMetadata:
@@ -101,9 +271,11 @@ class TypeMetadata:
 	@classmethod
 	def default(cls, asset):
 		if not cls.default_instance:
-			cls.default_instance = cls(asset)
+			# Only index structs.dat here; its trees are parsed on first use
+			instance = cls(asset)
 			with open(get_resource("structs.dat"), "rb") as f:
-				cls.default_instance.load(BinaryReader(f), format=15)
+				instance.load(MemoryReader(f.read()), format=15, lazy=True)
+			cls.default_instance = instance
 		return cls.default_instance
 
 	def __init__(self, asset):
@@ -114,7 +286,17 @@ class TypeMetadata:
 		self.generator_version = ""
 		self.target_platform = None
 
-	def load(self, buf, format=None):
+	@property
+	def registry(self):
+		environment = getattr(self.asset, "environment", None)
+		return getattr(environment, "type_registry", None)
+
+	def load(self, buf, format=None, lazy=False):
+		"""
+		Load the metadata from buf. If `lazy` is set (which requires a
+		MemoryReader and format 13 or later), the type trees are only
+		indexed, and parsed when they are first looked up.
+		"""
 		if format is None:
 			format = self.asset.format
 		self.generator_version = buf.read_string()
@@ -123,6 +305,9 @@ class TypeMetadata:
 		if format >= 13:
 			has_type_trees = buf.read_boolean()
 			num_types = buf.read_int()
+			if lazy:
+				self.type_trees = LazyTypeTrees(buf.buf, format)
+			registry = self.registry
 
 			for i in range(num_types):
 				class_id = buf.read_int()
@@ -147,9 +332,15 @@ class TypeMetadata:
 				self.hashes[class_id] = hash
 
 				if has_type_trees:
-					tree = TypeTree(format)
-					tree.load(buf)
-					self.type_trees[class_id] = tree
+					if lazy:
+						self.type_trees.offsets[class_id] = buf.tell()
+						TypeTree.skip_blob(buf, format)
+					elif registry is not None:
+						self.type_trees[class_id] = registry.load(buf, class_id, hash, format)
+					else:
+						tree = TypeTree(format)
+						tree.load(buf)
+						self.type_trees[class_id] = tree
 
 				# 4 unidentified bytes at the end of a type tree in 2019.4
 				if format >= 21:
@@ -1,5 +1,9 @@
+import mmap
 import struct
-from os import SEEK_CUR
+from collections import OrderedDict
+from io import BytesIO, UnsupportedOperation
+from os import SEEK_CUR, SEEK_END
+from threading import Lock
 
 
 def lz4_decompress(data, size):
@@ -43,20 +47,174 @@ def extract_audioclip_samples(d) -> dict:
 	return ret
 
 
+STRUCT_FORMATS = {
+	"b": 1, "B": 1, "h": 2, "H": 2, "i": 4, "I": 4, "q": 8, "Q": 8, "f": 4, "d": 8,
+}
+
+_structs = {}
+
+
+def get_structs(endian):
+	"""
+	Return a dict of precompiled Struct objects for each primitive format
+	in the given byte order.
+	"""
+	if endian not in _structs:
+		_structs[endian] = {fmt: struct.Struct(endian + fmt) for fmt in STRUCT_FORMATS}
+	return _structs[endian]
+
+
+def map_file(file):
+	"""
+	Memory-map `file` read-only. Returns None if the file cannot be mapped
+	(eg. it is not backed by a file descriptor, or is empty).
+	"""
+	try:
+		fileno = file.fileno()
+	except (AttributeError, OSError, UnsupportedOperation):
+		return None
+	try:
+		return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+	except (OSError, ValueError):
+		return None
+
+
+def make_reader(file, endian="<", use_mmap=False):
+	"""
+	Return a MemoryReader if the contents of `file` are already in memory
+	(bytes, memoryview, mmap, BytesIO or another MemoryReader), otherwise a
+	BinaryReader over the stream.
+	If `use_mmap` is set, files on disk are memory-mapped and read through a
+	MemoryReader as well; the mapping is closed with the reader.
+	"""
+	if use_mmap:
+		mapped = map_file(file)
+		if mapped is not None:
+			ret = MemoryReader(mapped, endian=endian, offset=file.tell())
+			ret.owns_buffer = True
+			return ret
+
+	if isinstance(file, MemoryReader):
+		return MemoryReader(file.buf, endian=endian, offset=file.tell())
+	elif isinstance(file, BytesIO):
+		return MemoryReader(file.getvalue(), endian=endian, offset=file.tell())
+	elif isinstance(file, (bytes, bytearray, memoryview, mmap.mmap)):
+		return MemoryReader(file, endian=endian)
+	return BinaryReader(file, endian=endian)
+
+
+class LRUCache:
+	"""
+	A thread-safe LRU cache bounded by the total size of its entries.
+	The size of each entry is given when it is added.
+	"""
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries = OrderedDict()
+		self._lock = Lock()
+
+	def __repr__(self):
+		return "<%s: %i/%i bytes, hits=%i, misses=%i, evictions=%i>" % (
+			self.__class__.__name__, self.size, self.max_size,
+			self.hits, self.misses, self.evictions
+		)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def get(self, key):
+		"""
+		Return the value for `key`, or None if it is not cached.
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self._entries.move_to_end(key)
+			return entry[0]
+
+	def put(self, key, value, size):
+		if size > self.max_size:
+			return
+		with self._lock:
+			self._remove(key)
+			self._entries[key] = (value, size)
+			self.size += size
+			while self.size > self.max_size:
+				key, (evicted, evicted_size) = self._entries.popitem(last=False)
+				self.size -= evicted_size
+				self.evictions += 1
+
+	def remove(self, key):
+		with self._lock:
+			self._remove(key)
+
+	def remove_if(self, predicate):
+		"""
+		Remove the entries whose key matches `predicate`.
+		"""
+		with self._lock:
+			for key in [key for key in self._entries if predicate(key)]:
+				self._remove(key)
+
+	def _remove(self, key):
+		entry = self._entries.pop(key, None)
+		if entry is not None:
+			self.size -= entry[1]
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.size = 0
+
+
 class BinaryReader:
 	def __init__(self, buf, endian="<"):
 		self.buf = buf
 		self.endian = endian
 
+	@property
+	def endian(self):
+		return self._endian
+
+	@endian.setter
+	def endian(self, value):
+		self._endian = value
+		self._structs = get_structs(value)
+
 	def align(self):
 		old = self.tell()
 		new = (old + 3) & -4
 		if new > old:
 			self.seek(new - old, SEEK_CUR)
 
+	def close(self):
+		# The stream belongs to whoever opened it
+		pass
+
 	def read(self, *args):
 		return self.buf.read(*args)
 
+	def read_view(self, size=-1):
+		# Streams cannot hand out views of their contents
+		return self.read(size)
+
+	def read_at(self, offset, size):
+		"""
+		Return `size` bytes at `offset`.
+		"""
+		self.seek(offset)
+		return self.read_view(size)
+
 	def seek(self, *args):
 		return self.buf.seek(*args)
 
@@ -74,41 +232,170 @@ class BinaryReader:
 			return ret
 
 	def read_cstring(self) -> bytes:
+		# Read ahead in growing chunks and give back what follows the string
 		ret = []
-		c = b""
-		while c != b"\0":
-			ret.append(c)
-			c = self.read(1)
-			if not c:
-				raise ValueError("Unterminated string: %r" % (ret))
-		return b"".join(ret)
+		size = 64
+		while True:
+			chunk = self.read(size)
+			if not chunk:
+				raise ValueError("Unterminated string: %r" % (b"".join(ret)))
+			end = chunk.find(b"\0")
+			if end != -1:
+				ret.append(chunk[:end])
+				if end + 1 < len(chunk):
+					self.seek(end + 1 - len(chunk), SEEK_CUR)
+				return b"".join(ret)
+			ret.append(chunk)
+			size = min(size * 2, 4096)
+
+	def read_boolean(self) -> bool:
+		return bool(self._structs["b"].unpack(self.read(1))[0])
+
+	def read_byte(self) -> int:
+		return self._structs["b"].unpack(self.read(1))[0]
+
+	def read_ubyte(self) -> int:
+		return self._structs["B"].unpack(self.read(1))[0]
+
+	def read_int16(self) -> int:
+		return self._structs["h"].unpack(self.read(2))[0]
+
+	def read_uint16(self) -> int:
+		return self._structs["H"].unpack(self.read(2))[0]
+
+	def read_int(self) -> int:
+		return self._structs["i"].unpack(self.read(4))[0]
+
+	def read_uint(self) -> int:
+		return self._structs["I"].unpack(self.read(4))[0]
+
+	def read_float(self) -> float:
+		return self._structs["f"].unpack(self.read(4))[0]
+
+	def read_double(self) -> float:
+		return self._structs["d"].unpack(self.read(8))[0]
+
+	def read_int64(self) -> int:
+		return self._structs["q"].unpack(self.read(8))[0]
+
+
+class MemoryReader(BinaryReader):
+	"""
+	A BinaryReader over an in-memory buffer (bytes, memoryview or mmap).
+	Values are unpacked in place at an integer cursor instead of going
+	through a stream read for every primitive.
+	"""
+	def __init__(self, buf, endian="<", offset=0):
+		self.buf = buf
+		self.view = memoryview(buf)
+		self.size = len(self.view)
+		self.pos = offset
+		self.endian = endian
+		# Set if the buffer is a mapping made for this reader
+		self.owns_buffer = False
+
+	def close(self):
+		"""
+		Release the reader's view of its buffer, and unmap the buffer if the
+		reader mapped it. A mapping which still has views in use elsewhere
+		is unmapped once they are released.
+		"""
+		try:
+			self.view.release()
+			if self.owns_buffer:
+				self.buf.close()
+		except BufferError:
+			pass
+
+	def align(self):
+		self.pos = (self.pos + 3) & -4
+
+	def read(self, size=-1):
+		return bytes(self.read_view(size))
+
+	def read_view(self, size=-1):
+		"""
+		Return a memoryview of the next `size` bytes, without copying them.
+		"""
+		start = self.pos
+		if size is None or size < 0:
+			end = self.size
+		else:
+			end = min(start + size, self.size)
+		self.pos = max(start, end)
+		return self.view[start:end]
+
+	def read_at(self, offset, size):
+		"""
+		Return a memoryview of `size` bytes at `offset`. The cursor is left
+		untouched, so this is safe to call from several threads at once.
+		"""
+		return self.view[offset:offset + size]
+
+	def seek(self, offset, whence=0):
+		if whence == SEEK_CUR:
+			offset += self.pos
+		elif whence == SEEK_END:
+			offset += self.size
+		if offset < 0:
+			raise ValueError("negative seek value %r" % (offset))
+		self.pos = offset
+		return offset
+
+	def tell(self):
+		return self.pos
+
+	def read_cstring(self) -> bytes:
+		pos = self.pos
+		if hasattr(self.buf, "find"):
+			end = self.buf.find(b"\0", pos)
+		else:
+			# Memoryviews can't be searched; scan them in growing chunks
+			end = -1
+			start, size = pos, 64
+			while start < self.size:
+				stop = min(start + size, self.size)
+				end = bytes(self.view[start:stop]).find(b"\0")
+				if end != -1:
+					end += start
+					break
+				start, size = stop, min(size * 2, 4096)
+		if end == -1:
+			raise ValueError("Unterminated string: %r" % (bytes(self.view[pos:])))
+		self.pos = end + 1
+		return bytes(self.view[pos:end])
+
+	def _unpack(self, fmt, size):
+		ret = self._structs[fmt].unpack_from(self.buf, self.pos)[0]
+		self.pos += size
+		return ret
 
 	def read_boolean(self) -> bool:
-		return bool(struct.unpack(self.endian + "b", self.read(1))[0])
+		return bool(self._unpack("b", 1))
 
 	def read_byte(self) -> int:
-		return struct.unpack(self.endian + "b", self.read(1))[0]
+		return self._unpack("b", 1)
 
 	def read_ubyte(self) -> int:
-		return struct.unpack(self.endian + "B", self.read(1))[0]
+		return self._unpack("B", 1)
 
 	def read_int16(self) -> int:
-		return struct.unpack(self.endian + "h", self.read(2))[0]
+		return self._unpack("h", 2)
 
 	def read_uint16(self) -> int:
-		return struct.unpack(self.endian + "H", self.read(2))[0]
+		return self._unpack("H", 2)
 
 	def read_int(self) -> int:
-		return struct.unpack(self.endian + "i", self.read(4))[0]
+		return self._unpack("i", 4)
 
 	def read_uint(self) -> int:
-		return struct.unpack(self.endian + "I", self.read(4))[0]
+		return self._unpack("I", 4)
 
 	def read_float(self) -> float:
-		return struct.unpack(self.endian + "f", self.read(4))[0]
+		return self._unpack("f", 4)
 
 	def read_double(self) -> float:
-		return struct.unpack(self.endian + "d", self.read(8))[0]
+		return self._unpack("d", 8)
 
 	def read_int64(self) -> int:
-		return struct.unpack(self.endian + "q", self.read(8))[0]
+		return self._unpack("q", 8)